@@ -9,7 +9,6 @@ from glob import glob
 from math import e, log
 import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
-from scipy.stats import mode
 
 import torch
 import torch.nn as nn
@@ -17,7 +16,11 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torchvision.utils import save_image
 
+import device
 import utils
+import sampler
+import population
+import ensemble
 import netdef
 import datagen
 import attacks
@@ -45,6 +48,8 @@ def load_args():
     parser.add_argument('--ft', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--hyper', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--task', type=str, default='train', metavar='N', help='')
+    parser.add_argument('--eval_budget', type=int, default=1024, help='MB of activations per ensemble tile')
+    parser.add_argument('--eval_chunk', type=int, default=100, help='members per ensemble stats update')
 
     args = parser.parse_args()
     return args
@@ -69,11 +74,7 @@ def entropy(y, base=None):
 # gradient under a new network for each iteration: IFGSM
 # One step attacks, do they transfer, no need to modify attacks here. 
 def sample_fmodel(args, hypernet, arch):
-    w_batch = utils.sample_hypernet(hypernet)
-    rand = np.random.randint(32)
-    sample_w = (w_batch[0][rand], w_batch[1][rand], w_batch[2][rand])
-    model = utils.weights_to_clf(sample_w, arch, args.stat['layer_names'])
-    model.eval()
+    model = sampler.pooled(hypernet, args).next_model(arch)
     fmodel = attacks.load_model(model)
     return model, fmodel
 
@@ -125,8 +126,8 @@ def sample_adv_batch(data, target, fmodel, eps, attack):
     if adv == []:
         adv_batch, target_batch = None, None
     else:
-        adv_batch = torch.stack(adv).cuda()
-        target_batch = torch.stack(y).cuda()
+        adv_batch = torch.stack(adv).to(device.get())
+        target_batch = torch.stack(y).to(device.get())
     return adv_batch, target_batch, inter
 
 
@@ -134,6 +135,8 @@ def sample_adv_batch(data, target, fmodel, eps, attack):
 def run_adv_hyper(args, hypernet):
     arch = get_network(args)
     model_base, fmodel_base = sample_fmodel(args, hypernet, arch)
+    pool = sampler.pooled(hypernet, args)
+    evaluator = population.EnsembleEvaluator(args.stat, args.eval_budget * 2**20)
     criterion = Misclassification()
     fgs = foolbox.attacks.BIM(fmodel_base, criterion)
     _, test_loader = datagen.load_mnist(args)
@@ -145,7 +148,7 @@ def run_adv_hyper(args, hypernet):
             acc, _accs = [], []
             _vars, _stds, _ents = [], [], []
             for idx, (data, target) in enumerate(test_loader):
-                data, target = data.cuda(), target.cuda()
+                data, target = data.to(device.get()), target.to(device.get())
                 adv_batch, target_batch, _ = sample_adv_batch(
                         data, target, fmodel_base, eps, fgs)
                 if adv_batch is None:
@@ -158,28 +161,17 @@ def run_adv_hyper(args, hypernet):
                 padv = np.argmax(fmodel_base.predictions(
                     adv_batch[0].cpu().numpy()))
 
-                sample_adv, pred_labels, logits = [], [], []
-                for _ in range(n_models):
-                    model, fmodel = sample_fmodel(args, hypernet, arch) 
-                    output = model(adv_batch)
-                    pred = output.data.max(1, keepdim=True)[1]
-                    correct = pred.eq(target_batch.data.view_as(pred)).long().cpu().sum()
-                    acc.append(correct.item())
-                    n_adv_sample = len(target_batch)-correct.item()
-                    sample_adv.append(n_adv_sample)
-                    pred_labels.append(pred.view(pred.numel()))
-                    logits.append(F.softmax(output, dim=1))
-                
-                p_labels = torch.stack(pred_labels).float().transpose(0, 1)
-                if len(p_labels) > 1:
-                    p_labels_cols = p_labels.transpose(0, 1)
-                    modes = mode(p_labels_cols)[0][0]
-                    mode_chart = []
-                    for i in range(len(modes)):
-                        v = len(np.setdiff1d(p_labels[i], modes[i], assume_unique=False))
-                        mode_chart.append(v)
-                    _vars.append(torch.tensor(mode_chart).float().mean())
-                    _ents.append(np.apply_along_axis(entropy, 1, p_labels.detach()).mean())
+                stats = ensemble.EnsembleStats()
+                for start in range(0, n_models, args.eval_chunk):
+                    logits = evaluator.sample(pool, min(args.eval_chunk, n_models - start), adv_batch)
+                    stats.update(logits)
+                    # correct per member
+                    acc.extend(logits.argmax(2).eq(target_batch.view(1, -1)).long().sum(1).tolist())
+                if len(target_batch) > 1:
+                    # labels voted for besides the majority one, per image
+                    others = stats.votes.gt(0).long().sum(1) - 1
+                    _vars.append(others.float().mean().cpu())
+                    _ents.append(stats.vote_entropy().mean().item())
                 acc = torch.tensor(acc, dtype=torch.float)
                 _accs.append(torch.mean(acc))
                 acc, adv, y = [], [], []
@@ -202,7 +194,7 @@ def run_adv_model(args, models):
         total_adv = 0
         _soft, _logs, _vars = [], [], []
         for idx, (data, target) in enumerate(test_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             adv_batch, target_batch, _ = sample_adv_batch(data, target, fmodel, eps, fgs)
             
             # get intial prediction of ensemble, sure
@@ -271,9 +263,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = models.Small().cuda()
+        model = models.Small().to(device.get())
     elif args.net == 'small2':
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -300,7 +292,7 @@ def adv_attack(args, path):
         models = []
         for path in paths:
             model = get_network(args)
-            model.load_state_dict(torch.load(path))
+            model.load_state_dict(device.load(path))
             models.append(model.eval())
         run_adv_model(args, models)
     
@@ -8,17 +8,21 @@ import numpy as np
 from math import e, log
 from glob import glob
 import matplotlib.pyplot as plt
-import statsmodels.api as sm
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
+import device
 import models.mnist_clf as models
 import models.models_mnist_small as hyper
 
 import utils
+import sampler
+import population
+import ensemble
+import sketch
 import datagen
 import netdef
 
@@ -35,20 +39,38 @@ def load_args():
     parser.add_argument('--ft', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--hyper', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--task', type=str, default='train', metavar='N', help='')
+    parser.add_argument('--sampling', type=str, default='iid', help='iid, antithetic or sobol latents')
+    parser.add_argument('--eval_budget', type=int, default=1024, help='MB of activations per ensemble tile')
+    parser.add_argument('--adaptive_tol', type=float, default=0., help='entropy 95%% interval half width, 0 for fixed sample counts')
+    parser.add_argument('--sample_step', type=int, default=10, help='networks drawn per adaptive round')
+    parser.add_argument('--max_samples', type=int, default=200, help='adaptive cap per input')
+    parser.add_argument('--out_dir', type=str, default='results', help='ecdf plots and score sketches')
+    parser.add_argument('--in_sketch', type=str, default='', help='saved in-distribution score sketch, for AUROC')
 
     args = parser.parse_args()
     return args
 
 
-def plot_empirical_cdf(args, a, n):
-    a = np.asarray(a).reshape(-1)
-    np.save('/scratch/eecs-share/ratzlafn/{}_{}_ent_data.npy'.format(args.dataset, n), a)
-    ecdf = sm.distributions.ECDF(a)
-    x = np.linspace(min(a), max(a))
-    y = ecdf(x)
+def plot_empirical_cdf(args, scores, n=''):
+    """
+    scores: a sketch.QuantileSketch, or a list of score arrays.
+    Saves the sketch and the ecdf plot to args.out_dir, and prints the
+    AUROC against args.in_sketch if given (a sketch saved here on inliers)
+    """
+    if not isinstance(scores, sketch.QuantileSketch):
+        scores = sketch.QuantileSketch().update(np.concatenate([np.ravel(a) for a in scores]))
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    path = os.path.join(args.out_dir, '{}_{}_ent'.format(args.dataset, n))
+    scores.save(path + '_sketch.npz')
+    x, y = scores.ecdf()
     plt.step(x, y)
-    print ('ecdf with {} samples'.format(len(a)))
-    plt.savefig('/scratch/eecs-share/ratzlafn/{}_{}_ent.png'.format(args.dataset, n))
+    print ('ecdf with {} samples, quantiles (5, 50, 95%): {}'.format(
+        scores.n, scores.quantile([.05, .5, .95])))
+    if args.in_sketch:
+        print ('AUROC against {}: {:.4f}'.format(
+            args.in_sketch, scores.auroc(sketch.load(args.in_sketch))))
+    plt.savefig(path + '.png')
 
 
 def entropy(x):
@@ -59,34 +81,37 @@ def entropy(x):
 
 
 def sample_model(hypernet, arch):
-    w_batch = utils.sample_hypernet(hypernet)
-    rand = np.random.randint(32)
-    sample_w = (w_batch[0][rand], w_batch[1][rand], w_batch[2][rand])
-    model = utils.weights_to_clf(sample_w, arch, args.stat['layer_names'])
-    model.eval()
+    model = sampler.pooled(hypernet, args).next_model(arch)
     return model
 
 
+def sample_models(args, hypernet, arch, n):
+    """ n target nets from one latent draw, args.sampling: iid, antithetic or sobol """
+    with torch.no_grad():
+        w_batch = utils.sample_hypernet(hypernet, args, n=-(-n // 32) * 32)
+    for sample_w in list(zip(*w_batch))[:n]:
+        model = utils.weights_to_clf(sample_w, arch, args.stat['layer_names'])
+        model.eval()
+        yield model
+
+
 def run_anomaly_omni(args, hypernet):
     arch = get_network(args)
     omni_loader = datagen.load_omniglot(args)
-    _vars, _stds, _ents = [], [], []
-    model = sample_model(hypernet, arch) 
+    _vars, _stds = [], []
+    scores = sketch.QuantileSketch()
+    pool = sampler.pooled(hypernet, args)
+    evaluator = population.EnsembleEvaluator(args.stat, args.eval_budget * 2**20)
     for idx, (data, target) in enumerate(omni_loader):
-        data, target = data.cuda(), target.cuda()
-        pred_labels = []
-        for _ in range(1000):
-            model = sample_model(hypernet, arch) 
-            output = model(data)
-            pred = output.data.max(1, keepdim=True)[1]
-            pred_labels.append(pred.view(pred.numel()))
-
-        p_labels = torch.stack(pred_labels).float().transpose(0, 1)
+        data, target = data.to(device.get()), target.to(device.get())
+        # 1000 fresh members per batch, one tiled pass instead of 1000 forwards
+        logits = evaluator.sample(pool, 1000, data)
+        p_labels = logits.max(2)[1].float().transpose(0, 1)
         _vars.append(p_labels.var(1).mean())
         _stds.append(p_labels.std(1).mean())
-        _ents.append(np.apply_along_axis(entropy, 1, p_labels))
+        scores.update(entropy(p_labels.cpu()))
 
-    plot_empirical_cdf(args, _ents)
+    plot_empirical_cdf(args, scores)
     print ('mean var: {}, min var: {}, max var:{}, std: {}'.format(
         torch.tensor(_vars).mean(), torch.tensor(_vars).max(), torch.tensor(_vars).min(),
         torch.tensor(_stds).mean()))
@@ -98,7 +123,7 @@ def run_anomaly_notmnist_(args, hypernet):
     _vars, _stds, _ents = [], [], []
     model = sample_model(hypernet, arch) 
     for idx, (data, target) in enumerate(train):
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         pred_labels = []
         logits = []
         for _ in range(100):
@@ -118,56 +143,72 @@ def run_anomaly_notmnist_(args, hypernet):
         torch.tensor(_stds).mean()))
 
 
+def run_anomaly_adaptive(args, hypernet, loader):
+    """ per input predictive entropy, sampling networks until it is within args.adaptive_tol """
+    pool = sampler.HypernetSampler(hypernet, args, mode=args.sampling)
+    evaluator = population.EnsembleEvaluator(args.stat, args.eval_budget * 2**20)
+    scores = sketch.QuantileSketch()
+    used_sum, used_max, capped = 0, 0, 0
+    for idx, (data, target) in enumerate(loader):
+        ent, used = ensemble.adaptive_entropy(evaluator, pool, data.to(device.get()),
+                args.adaptive_tol, args.sample_step, max_n=args.max_samples)
+        scores.update(ent)
+        used_sum += used.sum().item()
+        used_max = max(used_max, used.max().item())
+        capped += used.ge(args.max_samples).sum().item()
+    plot_empirical_cdf(args, scores, 'adaptive')
+    print ('mean E: {}, max E: {}, min E:{}'.format(scores.mean(), scores.max, scores.min))
+    print ('networks per input: mean {:.1f}, max {}, capped {:.1f}%'.format(
+        used_sum / float(scores.n), used_max, 100. * capped / scores.n))
+
+
 def run_anomaly_notmnist(args, hypernet):
     arch = get_network(args)
     train, test = datagen.load_notmnist(args)
-    _vars, _stds, _ents = [], [], []
+    if args.adaptive_tol:
+        return run_anomaly_adaptive(args, hypernet, test)
     model = sample_model(hypernet, arch) 
     for n in [200]:
+        scores = sketch.QuantileSketch()
         for idx, (data, target) in enumerate(test):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             pred_labels = []
             logits = []
-            for _ in range(n):
-                model = sample_model(hypernet, arch) 
+            for model in sample_models(args, hypernet, arch, n):
                 output = model(data)
                 logits.append(F.softmax(output, dim=1))
                 #logits.append(output)
             probs = torch.stack(logits)
             probs = probs.mean(0).float()
-            ent = torch.from_numpy(entropy(probs)).mean()
-            print (ent)
-            _ents.append(ent)
+            # one score per input, like the mnist runs the AUROC compares against
+            ent = entropy(probs.cpu())
+            print (ent.mean())
+            scores.update(ent)
             
-        plot_empirical_cdf(args, _ents, n)
-        print ('mean E: {}, max E: {}, min E:{}'.format(
-            torch.tensor(_ents).mean(),
-            torch.tensor(_ents).max(),
-            torch.tensor(_ents).min()))
+        plot_empirical_cdf(args, scores, n)
+        print ('mean E: {}, max E: {}, min E:{}'.format(scores.mean(), scores.max, scores.min))
 
 
 def run_anomaly_mnist(args, hypernet):
     arch = get_network(args)
     train, test  = datagen.load_mnist(args)
-    _vars, _stds, _ents = [], [], []
+    if args.adaptive_tol:
+        return run_anomaly_adaptive(args, hypernet, test)
     model = sample_model(hypernet, arch) 
     for n in [5, 10, 100]:
+        scores = sketch.QuantileSketch()
         for idx, (data, target) in enumerate(test):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             pred_labels = []
             logits = []
-            for _ in range(n):
-                model = sample_model(hypernet, arch) 
+            for model in sample_models(args, hypernet, arch, n):
                 output = model(data)
-                logits.append(output)
+                logits.append(F.softmax(output, dim=1))
             probs = torch.stack(logits).mean(0).float()
-            _ents.append(np.apply_along_axis(E, 1, probs.detach()))
+            scores.update(entropy(probs.cpu()))
         
-        plot_empirical_cdf(args, _ents, n)
-        print ('mean E: {}, max E: {}, min E:{}'.format(
-            torch.tensor(_ents).mean(),
-            torch.tensor(_ents).max(),
-            torch.tensor(_ents).min()))
+        plot_empirical_cdf(args, scores, n)
+        print ('mean E: {}, max E: {}, min E:{}'.format(scores.mean(), scores.max, scores.min))
 
 
 
@@ -178,7 +219,7 @@ def _run_anomaly_mnist(args, hypernet):
     model = sample_model(hypernet, arch) 
     for n in [5, 10, 100]:
         for idx, (data, target) in enumerate(test):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             pred_labels = []
             for _ in range(n):
                 model = sample_model(hypernet, arch) 
@@ -214,9 +255,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = models.Small().cuda()
+        model = models.Small().to(device.get())
     elif args.net == 'small2':
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -238,7 +279,7 @@ def run_anomaly(args, path):
     else:
         model = get_network(args)
         path = 'mnist_clf.pt'
-        model.load_state_dict(torch.load(path))
+        model.load_state_dict(device.load(path))
         run_adv_model(args, model)
     
 
@@ -285,7 +326,7 @@ def load_models(args, path):
                     #extract_weights_all(args, model, i)
             print(accs, losses)
         else:
-            ckpt = torch.load(path)
+            ckpt = device.load(path)
             state = ckpt['state_dict']
             try:
                 model.load_state_dict()
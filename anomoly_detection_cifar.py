@@ -10,6 +10,7 @@ import torch.backends.cudnn as cudnn
 import torch.optim as optim
 import matplotlib.pyplot as plt
 import natsort
+import device
 import utils
 import datagen
 import argparse
@@ -36,10 +37,8 @@ def load_args():
 
 
 def train(args, model, grad=False):
-    if args.dataset == 'cifar':
-        train_loader, _ = datagen.load_cifar(args)
-    elif args.dataset == 'cifar100':
-        train_loader, _ = datagen.load_10_class_cifar100(args)
+    name = {'cifar': 'cifar', 'cifar100': '10_class_cifar100'}[args.dataset]
+    train_loader, _ = datagen.loaders(args, name)
 
     train_loss, train_acc = 0., 0.
     criterion = nn.CrossEntropyLoss()
@@ -56,7 +55,7 @@ def train(args, model, grad=False):
         total = 0
         correct = 0
         for i, (data, target) in enumerate(train_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
@@ -73,15 +72,14 @@ def train(args, model, grad=False):
 
 def test(args, model, epoch=None, grad=False):
     model.eval()
-    if args.dataset == 'cifar':
-        _, test_loader = datagen.load_cifar(args)
-    elif args.dataset == 'cifar100':
-        _, test_loader = datagen.load_10_class_cifar100(args)
+    name = {'cifar': 'cifar', 'cifar100': '10_class_cifar100'}[args.dataset]
+    # held on device once, reused for every model evaluated
+    test_loader = datagen.device_split(args, name)
     test_loss = 0.
     correct = 0.
     criterion = nn.CrossEntropyLoss()
     for i, (data, target) in enumerate(test_loader):
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         output = model(data)
         if grad is False:
             test_loss += criterion(output, target).item()
@@ -133,15 +131,15 @@ def w_init(model, dist='normal'):
 
 def get_network(args):
     if args.net == 'cnet':
-        model = models.CNet().cuda()
+        model = models.CNet().to(device.get())
     elif args.net == 'wide':
-        model = models.WideNet().cuda()
+        model = models.WideNet().to(device.get())
     elif args.net == 'ctiny':
-        model = models.CTiny().cuda()
+        model = models.CTiny().to(device.get())
     elif args.net == 'lenet':
-        model = models.LeNet().cuda()
+        model = models.LeNet().to(device.get())
     elif args.net == 'mednet':
-        model = models.MedNet().cuda()
+        model = models.MedNet().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -167,7 +165,7 @@ def load_models(args, path):
     paths = natsort.natsorted(paths)
     for i, path in enumerate(paths):
         print ("loading model {}".format(path))
-        ckpt = torch.load(path)
+        ckpt = device.load(path)
         state = ckpt['state_dict']
         try: #bias issue: TODO remove this bit after HyperNet retraining
             model.load_state_dict(state)
@@ -0,0 +1,374 @@
+import time
+import argparse
+import resource
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+import torch.distributions.multivariate_normal as N
+from torch import optim
+
+import device
+import ops
+import utils
+import latent
+import netdef
+import population
+import sketch
+from models.bank import GeneratorBank
+from models.heads import make_head
+
+
+"""
+Micro benchmarks for the hypernet training and evaluation paths.
+Run one mode per process so peak memory (RSS on cpu) is not shared:
+    python bench.py --task step --target small2 --mode legacy
+    python bench.py --task step --target small2 --mode fused
+    python bench.py --task step --target small2 --batch_size 256 --population_chunk 32
+    python bench.py --task heads --head_in 6400 --ranks 0,4,8,16
+    python bench.py --task chunked --target wide7 --tile 4096 --chunk_batch 64
+    python bench.py --task recompute --target mednet --batch_size 32 --data_batch 100 --recompute none/layer/chunk
+    python bench.py --task qmc --batch_size 100 --steps 20 [--ckpt hypermnist_0_0.98.pt]
+    python bench.py --task ensemble --target small2 --batch_size 1000 --data_batch 100 --eval_budget 256
+    python bench.py --task sketch
+"""
+
+
+def load_args():
+    parser = argparse.ArgumentParser(description='hypernet benchmarks')
+    parser.add_argument('--task', default='step', type=str)
+    parser.add_argument('--device', default='', type=str, help='cuda or cpu, default cuda if available')
+    parser.add_argument('--threads', default=0, type=int, help='cpu intra-op threads, 0 for torch default')
+    parser.add_argument('--target', default='small2', type=str, help='small2 or mednet')
+    parser.add_argument('--mode', default='fused', type=str, help='legacy or fused')
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--beta', default=1000, type=float)
+    parser.add_argument('--steps', default=20, type=int)
+    parser.add_argument('--warmup', default=3, type=int)
+    parser.add_argument('--population_chunk', default=0, type=int, help='fused step only')
+    parser.add_argument('--head_in', default=6400, type=int, help='head input width')
+    parser.add_argument('--head_shape', default='32,32,5,5', type=str)
+    parser.add_argument('--ranks', default='0,4,8,16', type=str, help='0 is the dense head')
+    parser.add_argument('--tile', default=4096, type=int)
+    parser.add_argument('--chunk_dim', default=64, type=int)
+    parser.add_argument('--chunk_batch', default=64, type=int, help='0 generates all tiles at once')
+    parser.add_argument('--recompute', default='', type=str, help='none, layer or chunk')
+    parser.add_argument('--recompute_chunk', default=8, type=int)
+    parser.add_argument('--data_batch', default=100, type=int)
+    parser.add_argument('--eval_budget', default=1024, type=int, help='MB of activations per ensemble tile')
+    parser.add_argument('--ckpt', default='', type=str, help='mnist hypernet checkpoint, random init if empty')
+    args = parser.parse_args()
+    return args
+
+
+def build_hypernet(args):
+    """ same modules and shapes as hypermnist.py / hypercifar_small.py """
+    if args.target == 'small2':
+        import models.models_mnist_small as models
+        args.z, args.ze = 128, 300
+        n_layers, data_shape = 3, (1, 28, 28)
+    elif args.target == 'mednet':
+        import hypercifar_small as models
+        args.z, args.ze = 256, 512
+        n_layers, data_shape = 5, (3, 32, 32)
+    else:
+        raise NotImplementedError
+    args.stat = netdef.nets()[args.target]
+    args.shapes = args.stat['shapes']
+    netE = models.Encoder(args).to(device.get())
+    gens = [getattr(models, 'GeneratorW{}'.format(i+1))(args).to(device.get())
+            for i in range(n_layers)]
+    netD = models.DiscriminatorZ(args).to(device.get())
+    args.x_dist, args.z_dist = utils.create_d(args.ze), utils.create_d(args.z)
+    args.mvn = [N.MultivariateNormal(torch.zeros(d), torch.eye(d)) for d in (args.ze, args.z)]
+    data = torch.randn(args.batch_size, *data_shape).to(device.get())
+    target = torch.from_numpy(np.random.randint(10, size=args.batch_size)).to(device.get())
+    return netE, gens, netD, data, target
+
+
+def legacy_clf(args, Z, data, target):
+    """ the per network train_clf hypermnist.py / hypercifar_small.py used to have """
+    if args.target == 'small2':
+        x = F.max_pool2d(F.leaky_relu(F.conv2d(data, Z[0], stride=1)), 2, 2)
+        x = F.max_pool2d(F.leaky_relu(F.conv2d(x, Z[1], stride=1)), 2, 2)
+        x = F.linear(x.view(-1, 512), Z[2])
+    else:
+        x = F.max_pool2d(F.relu(F.conv2d(data, Z[0])), 2, 2)
+        x = F.max_pool2d(F.relu(F.conv2d(x, Z[1])), 2, 2)
+        x = F.max_pool2d(F.relu(F.conv2d(x, Z[2])), 2, 2)
+        x = F.relu(F.linear(x.view(x.size(0), -1), Z[3]))
+        x = F.linear(x, Z[4])
+    loss = F.cross_entropy(x, target)
+    pred = x.data.max(1, keepdim=True)[1]
+    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
+    return correct, loss
+
+
+def legacy_step(args, netE, gens, netD, data, target):
+    """
+    the old training step: MultivariateNormal latents copied to the device,
+    one D backward per code and one clf backward per network, each with the
+    graph retained
+    """
+    if args.target == 'small2':
+        # hypermnist.py built the distributions once, latents required grad
+        sample = lambda D, n: D.sample((n,)).to(device.get()).requires_grad_()
+        x_dist, z_dist = args.mvn
+    else:
+        # hypercifar_small.py built one per call, latents without grad
+        sample = lambda D, n: N.MultivariateNormal(
+                torch.zeros(D), torch.eye(D)).sample((n,)).to(device.get())
+        x_dist, z_dist = args.ze, args.z
+    z = sample(x_dist, args.batch_size)
+    codes = netE(z)
+    layers = [W(code) for W, code in zip(gens, codes)]
+    ops.free_params([netD])
+    ops.frozen_params([netE] + gens)
+    for code in codes:
+        noise = sample(z_dist, args.batch_size)
+        d_real = netD(noise)
+        d_fake = netD(code)
+        d_real_loss = -1 * torch.log((1-d_real).mean())
+        d_fake_loss = -1 * torch.log(d_fake.mean())
+        d_real_loss.backward(retain_graph=True)
+        d_fake_loss.backward(retain_graph=True)
+    ops.frozen_params([netD])
+    ops.free_params([netE] + gens)
+    for Z in zip(*layers):
+        correct, loss = legacy_clf(args, list(Z), data, target)
+        scaled_loss = args.beta * loss
+        scaled_loss.backward(retain_graph=True)
+
+
+def fused_step(args, netE, bank, netD, data, target):
+    """ the current step: one batched D pass on detached codes, one backward for the population """
+    z = utils.sample_d(args.x_dist, args.batch_size, grad=False)
+    codes = netE(z)
+    layers = bank(codes)
+    noise = utils.sample_d(args.z_dist, args.batch_size * len(codes), grad=False)
+    ops.free_params([netD])
+    d_loss = ops.z_adversary_loss(netD, codes, noise)
+    d_loss.backward()
+    ops.frozen_params([netD])
+    population.backward_clf(args, layers, data, target, args.beta)
+
+
+def peak_memory():
+    """ peak bytes: allocator high water mark on gpu, process RSS on cpu """
+    if device.get().type == 'cuda':
+        return torch.cuda.max_memory_allocated()
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def sync():
+    if device.get().type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def bench_step(args):
+    netE, gens, netD, data, target = build_hypernet(args)
+    if args.mode == 'fused':
+        gens = GeneratorBank(gens, args.shapes).to(device.get())
+        modules = [netE, netD, gens]
+    else:
+        modules = [netE, netD] + gens
+    params = [p for m in modules for p in m.parameters()]
+    optimizer = optim.Adam(params, lr=1e-4, betas=(0.5, 0.9))
+    step = {'legacy': legacy_step, 'fused': fused_step}[args.mode]
+    times = []
+    for i in range(args.warmup + args.steps):
+        sync()
+        start = time.time()
+        optimizer.zero_grad()
+        step(args, netE, gens, netD, data, target)
+        optimizer.step()
+        sync()
+        if i >= args.warmup:
+            times.append(time.time() - start)
+    print ('{} step, target {}: {:.2f} ms/step, peak memory {:.1f} MB'.format(
+        args.mode, args.target, 1000 * np.mean(times), peak_memory() / 2.**20))
+
+
+def bench_heads(args):
+    """ dense vs factorized output head: parameters, adam state, fwd+bwd time """
+    shape = [int(s) for s in args.head_shape.split(',')]
+    x = torch.randn(args.batch_size, args.head_in).to(device.get())
+    for rank in [int(r) for r in args.ranks.split(',')]:
+        head = make_head(args.head_in, shape, rank).to(device.get())
+        optimizer = optim.Adam(head.parameters(), lr=1e-4)
+        n_params = sum(p.numel() for p in head.parameters())
+        times = []
+        for i in range(args.warmup + args.steps):
+            sync()
+            start = time.time()
+            optimizer.zero_grad()
+            head(x).pow(2).mean().backward()
+            optimizer.step()
+            sync()
+            if i >= args.warmup:
+                times.append(time.time() - start)
+        # adam keeps two fp32 moments per parameter
+        print ('{} head {} -> {}: {:.1f}M params, {:.1f} MB adam state, {:.2f} ms/step'.format(
+            'rank {}'.format(rank) if rank else 'dense', args.head_in, shape,
+            n_params / 1e6, 2 * 4 * n_params / 2.**20, 1000 * np.mean(times)))
+
+
+def bench_chunked(args):
+    """ chunked generator for a wide target: parameters, fwd+bwd time, peak memory """
+    import models.chunked as chunked
+    args.z, args.ze = 128, 300
+    args.stat = netdef.nets()[args.target]
+    args.shapes = args.stat['shapes']
+    netG = chunked.ChunkedGenerator(args).to(device.get())
+    n_params = sum(p.numel() for p in netG.parameters())
+    codes = [torch.randn(args.batch_size, args.z).to(device.get()) for _ in args.shapes]
+    times = []
+    for i in range(args.warmup + args.steps):
+        sync()
+        start = time.time()
+        netG.zero_grad()
+        sum(l.pow(2).mean() for l in netG(codes)).backward()
+        sync()
+        if i >= args.warmup:
+            times.append(time.time() - start)
+    print ('chunked {}, tile {}, chunk_batch {}: {:.1f}M params, {:.2f} ms/step, peak memory {:.1f} MB'.format(
+        args.target, args.tile, args.chunk_batch, n_params / 1e6,
+        1000 * np.mean(times), peak_memory() / 2.**20))
+
+
+def bench_recompute(args):
+    """ target forward + backward for a population, with and without recompute """
+    args.stat = netdef.nets()[args.target]
+    shape = {'mednet': (3, 32, 32)}.get(args.target, (1, 28, 28))
+    Z = [torch.randn(args.batch_size, *s).mul_(0.1).to(device.get()).requires_grad_()
+            for s in args.stat['shapes']]
+    data = torch.randn(args.data_batch, *shape)
+    target = torch.from_numpy(np.random.randint(10, size=args.data_batch))
+    times = []
+    for i in range(args.warmup + args.steps):
+        sync()
+        start = time.time()
+        correct, loss = population.train_clf(args, Z, data, target)
+        grads = torch.autograd.grad(loss.sum(), Z)
+        sync()
+        if i >= args.warmup:
+            times.append(time.time() - start)
+    print ('recompute {}, target {}, {} nets x {} images: {:.2f} ms/step, peak memory {:.1f} MB'.format(
+        args.recompute or 'none', args.target, args.batch_size, args.data_batch,
+        1000 * np.mean(times), peak_memory() / 2.**20))
+
+
+def bench_qmc(args):
+    """ i.i.d. draws worth of antithetic / sobol latents for the ensemble mean prediction """
+    args.target = 'small2'
+    netE, gens, netD, data, target = build_hypernet(args)
+    if args.ckpt:
+        netE, W1, W2, W3 = utils.load_hypernet(args.ckpt)
+        gens = [W1, W2, W3]
+    data = torch.randn(args.data_batch, 1, 28, 28).to(device.get())
+    forward = population.compile_net(args.stat)
+    # running batchnorm stats, so draws in one estimate do not interact
+    for m in [netE] + gens:
+        m.eval()
+
+    def statistic(z):
+        with torch.no_grad():
+            layers = [W(code) for W, code in zip(gens, netE(z))]
+            return torch.softmax(forward(layers, data), -1).mean(0)
+
+    # batch_size draws per estimate, steps independently seeded estimates
+    report = latent.efficiency(statistic, args.ze, args.batch_size, args.steps)
+    for mode, (var, n_iid) in sorted(report.items()):
+        print ('{}: {} draws, estimator variance {:.3e}, worth {:.0f} iid draws ({:.2f}x)'.format(
+            mode, args.batch_size, var, n_iid, n_iid / args.batch_size))
+
+
+def bench_ensemble(args):
+    """ batch_size members on data_batch images: one net at a time vs EnsembleEvaluator """
+    args.stat = netdef.nets()[args.target]
+    shape = {'mednet': (3, 32, 32)}.get(args.target, (1, 28, 28))
+    Z = [torch.randn(args.batch_size, *s).mul_(0.1).to(device.get()) for s in args.stat['shapes']]
+    data = torch.randn(args.data_batch, *shape).to(device.get())
+    forward = population.compile_net(args.stat)
+    evaluator = population.EnsembleEvaluator(args.stat, args.eval_budget * 2**20)
+
+    def sequential():
+        with torch.no_grad():
+            return torch.stack([forward([w[i] for w in Z], data) for i in range(args.batch_size)])
+
+    for name, run in [('sequential', sequential), ('evaluator', lambda: evaluator(Z, data))]:
+        times = []
+        for i in range(args.warmup + args.steps):
+            sync()
+            start = time.time()
+            logits = run()
+            sync()
+            if i >= args.warmup:
+                times.append(time.time() - start)
+        print ('{} {}, {} nets x {} images: {:.2f} ms, {:.0f} nets/s'.format(
+            name, args.target, args.batch_size, args.data_batch,
+            1000 * np.mean(times), args.batch_size / np.mean(times)))
+    print ('tiles (nets, images): {}, max abs diff {:.2e}'.format(
+        evaluator.tiles(args.batch_size, data), (sequential() - evaluator(Z, data)).abs().max()))
+
+
+def bench_sketch(args):
+    """ QuantileSketch against exact numpy answers on fixed seed normal scores """
+    rng = np.random.RandomState(0)
+    inliers, outliers = rng.randn(200000), rng.randn(100000) + 1
+    parts = []
+    for scores in (inliers, outliers):
+        parts.append(sketch.QuantileSketch(seed=0))
+        for batch in np.array_split(scores, 400):
+            parts[-1].update(batch)
+    ins, outs = parts
+    merged = sketch.QuantileSketch(seed=1).merge(ins).merge(outs)
+    both = np.sort(np.concatenate([inliers, outliers]))
+    for s, exact in [(ins, np.sort(inliers)), (merged, both)]:
+        items, weights = s.weighted()
+        assert weights.sum() == s.n == len(exact)
+        q = np.linspace(0.01, 0.99, 99)
+        # rank of the sketch's quantile among the exact scores
+        err = np.abs(np.searchsorted(exact, s.quantile(q)) / float(len(exact)) - q).max()
+        print ('{} scores in {} items, max rank error {:.4f}'.format(s.n, len(items), err))
+        assert err < 0.02
+    exact_auroc = np.searchsorted(np.sort(inliers), outliers).mean() / len(inliers)
+    print ('auroc {:.4f}, exact {:.4f}'.format(outs.auroc(ins), exact_auroc))
+    assert abs(outs.auroc(ins) - exact_auroc) < 0.01
+    # low quantiles on long streams, where a compaction that always leaves
+    # the same tail behind drifts; signed errors are averaged over seeds
+    q = np.array([0.001, 0.005, 0.01, 0.02, 0.05, 0.1])
+    errs = []
+    for seed in range(5):
+        scores = np.random.RandomState(seed).rand(2000000)
+        s = sketch.QuantileSketch(seed=seed)
+        for batch in np.array_split(scores, 4000):
+            s.update(batch)
+        errs.append(np.searchsorted(np.sort(scores), s.quantile(q)) / float(len(scores)) - q)
+    errs = np.array(errs)
+    print ('long stream low quantiles {}, max rank error {:.4f}, mean {:.4f}'.format(
+        q, np.abs(errs).max(), np.abs(errs.mean(0)).max()))
+    assert np.abs(errs).max() < 0.015
+    assert np.abs(errs.mean(0)).max() < 0.003
+
+
+if __name__ == '__main__':
+    args = load_args()
+    device.configure(args.device, threads=args.threads)
+    if args.task == 'step':
+        bench_step(args)
+    elif args.task == 'heads':
+        bench_heads(args)
+    elif args.task == 'chunked':
+        bench_chunked(args)
+    elif args.task == 'recompute':
+        bench_recompute(args)
+    elif args.task == 'qmc':
+        bench_qmc(args)
+    elif args.task == 'ensemble':
+        bench_ensemble(args)
+    elif args.task == 'sketch':
+        bench_sketch(args)
+    else:
+        raise NotImplementedError
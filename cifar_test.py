@@ -10,6 +10,7 @@ import torch.backends.cudnn as cudnn
 import torch.optim as optim
 import matplotlib.pyplot as plt
 import natsort
+import device
 import utils
 import argparse
 from glob import glob
@@ -83,7 +84,7 @@ def train(model, grad=False, e=2):
         total = 0
         correct = 0
         for i, (data, target) in enumerate(train_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
@@ -108,7 +109,7 @@ def test(model, epoch=None, grad=False):
     correct = 0.
     criterion = nn.CrossEntropyLoss()
     for i, (data, target) in enumerate(test_loader):
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         output = model(data)
         if grad is False:
             test_loss += criterion(output, target).item()
@@ -180,15 +181,15 @@ def w_init(model, dist='normal'):
 
 def get_network(args):
     if args.net == 'cnet':
-        model = CNet().cuda()
+        model = CNet().to(device.get())
     elif args.net == 'wide':
-        model = WideNet().cuda()
+        model = WideNet().to(device.get())
     elif args.net == 'ctiny':
-        model = CTiny().cuda()
+        model = CTiny().to(device.get())
     elif args.net == 'lenet':
-        model = LeNet().cuda()
+        model = LeNet().to(device.get())
     elif args.net == 'mednet':
-        model = MedNet().cuda()
+        model = MedNet().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -210,14 +211,14 @@ def run_model_search(args):
 def load_models(args):
 
     import mnist
-    model = mnist.Small2().cuda()
+    model = mnist.Small2().to(device.get())
     paths = glob('exp_models/*.pt'.format(args.net))
     natpaths = natsort.natsorted(paths)
     ckpts = []
     print (len(paths))
     for i, path in enumerate(natpaths):
         print ("loading model {}".format(path))
-        ckpt = torch.load(path)
+        ckpt = device.load(path)
         ckpts.append(ckpt)
         #model.load_state_dict(ckpt)
         model.load_state_dict(ckpt['state'])
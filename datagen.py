@@ -1,8 +1,11 @@
 import os
+import hashlib
 import numpy as np
+import device
 import utils
 import torch
 import torchvision
+import torch.nn.functional as F
 import pickle
 from torchvision import datasets, transforms
 from scipy.misc import imread,imresize
@@ -10,12 +13,249 @@ from sklearn.model_selection import train_test_split
 from glob import glob
 
 
+class TensorLoader(object):
+    """
+    a whole split held as one tensor, batched by index permutation
+    iterates (data, target) like a DataLoader and keeps .dataset for len()
+    """
+    def __init__(self, data, targets, batch_size, shuffle=False, drop_last=True, seed=None):
+        self.dataset = torch.utils.data.TensorDataset(data, targets)
+        self.data, self.targets = data, targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        # own generator when seeded, so the order (and augmentation) replays
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
+    def __len__(self):
+        n = len(self.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return -(-n // self.batch_size)
+
+    def __iter__(self):
+        n = len(self.dataset)
+        order = torch.randperm(n, generator=self.generator) if self.shuffle else torch.arange(n)
+        for i in range(len(self)):
+            yield self._batch(order[i*self.batch_size:(i+1)*self.batch_size])
+
+    def _batch(self, idx):
+        return self.data[idx], self.targets[idx]
+
+
+class AugmentLoader(TensorLoader):
+    """
+    uint8 (N, C, H, W) images, augmented and normalized a batch at a time:
+    zero pad + random crop + horizontal flip as one gather, like
+    RandomCrop(32, padding=4) + RandomHorizontalFlip + ToTensor + Normalize
+    """
+    def __init__(self, data, targets, batch_size, mean, std, augment=True,
+            padding=4, shuffle=False, drop_last=True, seed=None):
+        super(AugmentLoader, self).__init__(data, targets, batch_size,
+                shuffle, drop_last, seed)
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.augment = augment
+        self.padding = padding
+
+    def _crop_flip(self, x):
+        b, c, h, w = x.shape
+        p = self.padding
+        x = F.pad(x, (p, p, p, p))
+        oy = torch.randint(0, 2*p+1, (b, 1), generator=self.generator)
+        ox = torch.randint(0, 2*p+1, (b, 1), generator=self.generator)
+        flip = torch.rand(b, 1, generator=self.generator) < 0.5
+        cols = torch.arange(w).view(1, -1)
+        rows = (oy + torch.arange(h).view(1, -1)).view(b, h, 1)
+        cols = (ox + torch.where(flip, cols.flip(1), cols)).view(b, 1, w)
+        x = x[torch.arange(b).view(-1, 1, 1), :, rows, cols]
+        return x.permute(0, 3, 1, 2).contiguous()
+
+    def _batch(self, idx):
+        x = self.data[idx]
+        if self.augment:
+            x = self._crop_flip(x)
+        x = x.float().div_(255.).sub_(self.mean).div_(self.std)
+        return x, self.targets[idx]
+
+
+class LabelIndex(object):
+    """
+    class -> sample indices, built from a raw targets array so no sample is
+    ever decoded (or augmented) to read its label
+    """
+    def __init__(self, targets):
+        targets = np.asarray(targets).astype(np.int64)
+        order = np.argsort(targets, kind='stable')
+        self.classes, counts = np.unique(targets, return_counts=True)
+        self.index = dict(zip(self.classes.tolist(),
+            [torch.from_numpy(i) for i in np.split(order, np.cumsum(counts)[:-1])]))
+
+    def count(self, c):
+        return len(self.index.get(c, []))
+
+    def select(self, classes=None, per_class=None, fraction=None, seed=None):
+        """
+        sorted indices of the given classes (default all), randomly cut to
+        per_class samples each and/or a stratified fraction of each class
+        """
+        generator = None
+        if seed is not None:
+            generator = torch.Generator()
+            generator.manual_seed(seed)
+        if classes is None:
+            classes = self.classes.tolist()
+        idx = []
+        for c in classes:
+            members = self.index.get(c, torch.zeros(0, dtype=torch.long))
+            n = k = len(members)
+            if per_class is not None:
+                k = min(k, per_class)
+            if fraction is not None:
+                k = min(k, int(round(n * fraction)))
+            if k < n:
+                members = members[torch.randperm(n, generator=generator)[:k]]
+            idx.append(members)
+        if not idx:
+            return torch.zeros(0, dtype=torch.long)
+        return torch.cat(idx).sort()[0]
+
+
+def raw_targets(split):
+    """ labels of a torchvision dataset without touching its samples """
+    if hasattr(split, 'targets'):
+        return split.targets
+    if hasattr(split, 'train_labels'):
+        return split.train_labels if split.train else split.test_labels
+    return [t for _, t in split.samples]
+
+
+def _classes(args):
+    classes = getattr(args, 'classes', None)
+    if isinstance(classes, str):
+        parsed = [int(c) for c in classes.split(',') if c.strip()]
+        if classes.strip() and not parsed:
+            raise ValueError('--classes {!r} names no class'.format(classes))
+        classes = parsed
+    return classes or None
+
+
+def _subset(args, split, train, classes=None):
+    """
+    cut a (data, targets) split to classes (default args.classes), and for
+    training splits to args.per_class / args.fraction samples per class
+    """
+    classes = classes if classes is not None else _classes(args)
+    per_class = getattr(args, 'per_class', None) if train else None
+    fraction = getattr(args, 'fraction', None) if train else None
+    if classes is None and per_class is None and fraction is None:
+        return split
+    data, targets = split
+    idx = LabelIndex(targets.numpy()).select(classes, per_class, fraction,
+            getattr(args, 'seed', None))
+    return data[idx], targets[idx]
+
+
+CACHE_VERSION = 1
+
+
+def cached_split(args, key, build, source):
+    """
+    (data, targets) of a preprocessed split from the .npy cache in
+    args.cache_dir or $HYPER_CACHE, written by build() on first use; with
+    neither set there is no cache and build() runs every time. The file
+    name carries a hash of the source dataset path, so --scratch and ./data
+    copies never share an entry. Arrays are memory mapped copy-on-write,
+    so concurrent processes share the page cache instead of private copies.
+    Bump CACHE_VERSION when the preprocessing changes.
+    """
+    root = getattr(args, 'cache_dir', None) or os.environ.get('HYPER_CACHE')
+    if not root:
+        return build()
+    digest = hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:10]
+    prefix = os.path.join(root, '{}_{}_v{}'.format(key, digest, CACHE_VERSION))
+    paths = [prefix + '_data.npy', prefix + '_targets.npy']
+    if not all(os.path.exists(p) for p in paths):
+        os.makedirs(root, exist_ok=True)
+        for path, array in zip(paths, build()):
+            # write then rename, readers never see a partial file
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, array.numpy())
+            os.replace(tmp, path)
+    return tuple(torch.from_numpy(np.load(p, mmap_mode='c')) for p in paths)
+
+
+def _mnist_split(dataset, path, train, download=False, mean=0.1307, std=0.3081):
+    """ decode an MNIST format split once, same values as ToTensor + Normalize """
+    split = dataset(path, train=train, download=download)
+    if hasattr(split, 'targets'):
+        data, targets = split.data, split.targets
+    elif train:
+        data, targets = split.train_data, split.train_labels
+    else:
+        data, targets = split.test_data, split.test_labels
+    data = data.float().div_(255.).sub_(mean).div_(std).unsqueeze(1).contiguous()
+    return data, targets.long()
+
+
+def _tensor_loaders(args, name, dataset, path, batch_size, shuffle_train=True, download=False):
+    def split(train):
+        key = '{}_{}_0.1307_0.3081'.format(name, 'train' if train else 'test')
+        return cached_split(args, key, lambda: _mnist_split(dataset, path, train, download), path)
+    train = TensorLoader(*_subset(args, split(True), True),
+            batch_size=batch_size, shuffle=shuffle_train)
+    test = TensorLoader(*_subset(args, split(False), False),
+            batch_size=batch_size, shuffle=True)
+    return train, test
+
+
+cifar_mean = (0.4914, 0.4822, 0.4465)
+cifar_std = (0.2023, 0.1994, 0.2010)
+
+
+def _cifar_split(split):
+    """ torchvision CIFAR split -> uint8 (N, 3, 32, 32) images, long targets """
+    if hasattr(split, 'targets'):
+        data, targets = split.data, split.targets
+    elif split.train:
+        data, targets = split.train_data, split.train_labels
+    else:
+        data, targets = split.test_data, split.test_labels
+    data = torch.from_numpy(np.asarray(data)).permute(0, 3, 1, 2).contiguous()
+    return data, torch.tensor(targets).long()
+
+
+def _folder_split(path):
+    """ decode an ImageFolder once into uint8 images and targets """
+    split = torchvision.datasets.ImageFolder(root=path)
+    data = np.stack([np.asarray(split.loader(p).convert('RGB')) for p, _ in split.samples])
+    targets = [t for _, t in split.samples]
+    return torch.from_numpy(data).permute(0, 3, 1, 2).contiguous(), torch.tensor(targets).long()
+
+
+def _augment_loaders(args, train, test, batch_size, shuffle_test=False, classes=None):
+    seed = getattr(args, 'seed', None)
+    train = _subset(args, train, True, classes)
+    test = _subset(args, test, False, classes)
+    train = AugmentLoader(*train, batch_size=batch_size, mean=cifar_mean,
+            std=cifar_std, shuffle=True, seed=seed)
+    test = AugmentLoader(*test, batch_size=batch_size, mean=cifar_mean,
+            std=cifar_std, augment=False, shuffle=shuffle_test, seed=seed)
+    return train, test
+
+
 def load_mnist(args):
     torch.cuda.manual_seed(1)
-    kwargs = {'num_workers': 1, 'pin_memory': True, 'drop_last': True}
+    kwargs = {'num_workers': 1, 'pin_memory': device.pin_memory(), 'drop_last': True}
     path = 'data_m/'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        return _tensor_loaders(args, 'mnist', datasets.MNIST, path, 32, download=True)
     train_loader = torch.utils.data.DataLoader(
             datasets.MNIST(path, train=True, download=True,
                 transform=transforms.Compose([
@@ -35,10 +275,12 @@ def load_mnist(args):
 
 def load_notmnist(args):
     torch.cuda.manual_seed(1)
-    kwargs = {'num_workers': 1, 'pin_memory': True, 'drop_last': True}
+    kwargs = {'num_workers': 1, 'pin_memory': device.pin_memory(), 'drop_last': True}
     path = 'data_nm/'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        return _tensor_loaders(args, 'notmnist', datasets.MNIST, path, 32, shuffle_train=False)
     train_loader = torch.utils.data.DataLoader(
             datasets.MNIST(path, train=True,
                 transform=transforms.Compose([
@@ -56,12 +298,14 @@ def load_notmnist(args):
     return train_loader, test_loader
 
 
-def load_fashion_mnist():
+def load_fashion_mnist(args):
     path = 'data_f'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
     torch.cuda.manual_seed(1)
-    kwargs = {'num_workers': 1, 'pin_memory': True, 'drop_last': True}
+    kwargs = {'num_workers': 1, 'pin_memory': device.pin_memory(), 'drop_last': True}
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        return _tensor_loaders(args, 'fashion_mnist', datasets.FashionMNIST, path, 64, download=True)
     train_loader = torch.utils.data.DataLoader(
             datasets.FashionMNIST(path, train=True, download=True,
                 transform=transforms.Compose([
@@ -83,7 +327,13 @@ def load_cifar(args):
     path = './data_c'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
-    kwargs = {'num_workers': 2, 'pin_memory': True, 'drop_last': True}
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        train = cached_split(args, 'cifar10_train', lambda: _cifar_split(
+            torchvision.datasets.CIFAR10(root=path, train=True)), path)
+        test = cached_split(args, 'cifar10_test', lambda: _cifar_split(
+            torchvision.datasets.CIFAR10(root=path, train=False)), path)
+        return _augment_loaders(args, train, test, 32)
+    kwargs = {'num_workers': 2, 'pin_memory': device.pin_memory(), 'drop_last': True}
     transform_train = transforms.Compose([
         transforms.RandomCrop(32, padding=4),
         transforms.RandomHorizontalFlip(),
@@ -109,7 +359,13 @@ def load_cifar_hidden(args, c_idx):
     path = './data_c'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
-    kwargs = {'num_workers': 2, 'pin_memory': True, 'drop_last': True}
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        train = cached_split(args, 'cifar10_train', lambda: _cifar_split(
+            torchvision.datasets.CIFAR10(root=path, train=True)), path)
+        test = cached_split(args, 'cifar10_test', lambda: _cifar_split(
+            torchvision.datasets.CIFAR10(root=path, train=False)), path)
+        return _augment_loaders(args, train, test, 32, shuffle_test=True, classes=list(c_idx))
+    kwargs = {'num_workers': 2, 'pin_memory': device.pin_memory(), 'drop_last': True}
     transform_train = transforms.Compose([
         transforms.RandomCrop(32, padding=4),
         transforms.RandomHorizontalFlip(),
@@ -120,21 +376,18 @@ def load_cifar_hidden(args, c_idx):
         transforms.ToTensor(),
         transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010)),
         ])  
-    def get_classes(target, labels):
-        label_indices = []
-        for i in range(len(target)):
-            if target[i][1] in labels:
-                label_indices.append(i)
-        return label_indices
-
+    seed = getattr(args, 'seed', None)
     trainset = torchvision.datasets.CIFAR10(root=path, train=True,
             download=False, transform=transform_train)
-    train_hidden = torch.utils.data.Subset(trainset, get_classes(trainset, c_idx))
+    train_idx = LabelIndex(raw_targets(trainset)).select(list(c_idx),
+            getattr(args, 'per_class', None), getattr(args, 'fraction', None), seed)
+    train_hidden = torch.utils.data.Subset(trainset, train_idx.tolist())
     trainloader = torch.utils.data.DataLoader(train_hidden, batch_size=32,
             shuffle=True, **kwargs)
     testset = torchvision.datasets.CIFAR10(root=path, train=False,
             download=False, transform=transform_test)
-    test_hidden = torch.utils.data.Subset(testset, get_classes(testset, c_idx))
+    test_idx = LabelIndex(raw_targets(testset)).select(list(c_idx))
+    test_hidden = torch.utils.data.Subset(testset, test_idx.tolist())
     testloader = torch.utils.data.DataLoader(test_hidden, batch_size=32,
             shuffle=True, **kwargs)
     return trainloader, testloader
@@ -144,7 +397,13 @@ def load_cifar100(args):
     path = './data_c100'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
-    kwargs = {'num_workers': 2, 'pin_memory': True, 'drop_last': True}
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        train = cached_split(args, 'cifar100_train', lambda: _cifar_split(
+            torchvision.datasets.CIFAR100(root=path, train=True, download=True)), path)
+        test = cached_split(args, 'cifar100_test', lambda: _cifar_split(
+            torchvision.datasets.CIFAR100(root=path, train=False, download=True)), path)
+        return _augment_loaders(args, train, test, 32)
+    kwargs = {'num_workers': 2, 'pin_memory': device.pin_memory(), 'drop_last': True}
     transform_train = transforms.Compose([
         transforms.RandomCrop(32, padding=4),
         transforms.RandomHorizontalFlip(),
@@ -168,7 +427,7 @@ def load_cifar100(args):
 
 def load_omniglot(args):
     torch.cuda.manual_seed(1)
-    kwargs = {'num_workers': 1, 'pin_memory': True, 'drop_last': True}
+    kwargs = {'num_workers': 1, 'pin_memory': device.pin_memory(), 'drop_last': True}
     path = 'data_o/'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
@@ -186,7 +445,11 @@ def load_10_class_cifar100(args):
     path = 'cifar-100-python'
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/' + path
-    kwargs = {'num_workers': 2, 'pin_memory': True, 'drop_last': True}
+    if getattr(args, 'loader', 'tensor') == 'tensor':
+        train = cached_split(args, 'cifar100_10_train', lambda: _folder_split(path+'/train'), path)
+        test = cached_split(args, 'cifar100_10_test', lambda: _folder_split(path+'/test'), path)
+        return _augment_loaders(args, train, test, 32)
+    kwargs = {'num_workers': 2, 'pin_memory': device.pin_memory(), 'drop_last': True}
     transform_train = transforms.Compose([
         transforms.RandomCrop(32, padding=4),
         transforms.RandomHorizontalFlip(),
@@ -208,3 +471,51 @@ def load_10_class_cifar100(args):
     return trainloader, testloader
 
 
+
+
+_registry = {}
+
+
+def _key(args, name):
+    """
+    everything in args that changes what load_<name>(args) returns: the
+    source and loader mode, the seed (shuffle order and subset draw), the
+    split cache location and the subset settings. The loaders fix their
+    own batch sizes, so args.batch_size is not part of it.
+    """
+    return (name, getattr(args, 'loader', 'tensor'), getattr(args, 'scratch', False),
+            getattr(args, 'seed', None),
+            getattr(args, 'cache_dir', None) or os.environ.get('HYPER_CACHE'),
+            str(_classes(args)), getattr(args, 'per_class', None),
+            getattr(args, 'fraction', None))
+
+
+def loaders(args, name):
+    """
+    (train, test) from load_<name>(args), built once per process and keyed
+    by what changes them (see _key), so evaluation loops that ask for the
+    data per model reuse the same handles
+    """
+    key = _key(args, name)
+    if key not in _registry:
+        _registry[key] = globals()['load_' + name](args)
+    return _registry[key]
+
+
+def device_split(args, name, split='test'):
+    """
+    one split of load_<name> held on the configured device, decoded and
+    normalized once; iterates like the loader without host to device copies
+    """
+    key = ('device', split, str(device.get())) + _key(args, name)
+    if key not in _registry:
+        loader = loaders(args, name)[split == 'test']
+        if getattr(loader, 'augment', False):
+            raise ValueError('{} {} is augmented per batch, use loaders()'.format(name, split))
+        if isinstance(loader, TensorLoader):
+            data, targets = loader._batch(torch.arange(len(loader.dataset)))
+        else:
+            data, targets = [torch.cat(t) for t in zip(*list(loader))]
+        _registry[key] = TensorLoader(data.to(device.get()), targets.to(device.get()),
+                loader.batch_size, shuffle=split == 'train')
+    return _registry[key]
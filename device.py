@@ -0,0 +1,55 @@
+import os
+import torch
+
+
+"""
+Process wide execution settings: the device everything runs on, the default
+float dtype and the cpu thread counts. Set once at startup with configure()
+(scripts pass their --device / --threads flags), or through the environment:
+    HYPER_DEVICE=cpu HYPER_THREADS=16 python hypermnist.py
+Anything that used to call .cuda() moves tensors and modules with
+.to(device.get()) instead, and loaders ask pin_memory() whether to pin.
+"""
+
+
+_device = None
+
+
+def configure(name=None, dtype=None, threads=None, interop_threads=None):
+    """ pick the device (default cuda when available), dtype and cpu threads """
+    global _device
+    name = name or os.environ.get('HYPER_DEVICE')
+    if not name:
+        name = 'cuda' if torch.cuda.is_available() else 'cpu'
+    _device = torch.device(name)
+    dtype = dtype or os.environ.get('HYPER_DTYPE')
+    if dtype:
+        torch.set_default_dtype(getattr(torch, dtype) if isinstance(dtype, str) else dtype)
+    threads = threads or int(os.environ.get('HYPER_THREADS', 0))
+    if threads:
+        torch.set_num_threads(threads)
+    interop_threads = interop_threads or int(os.environ.get('HYPER_INTEROP_THREADS', 0))
+    if interop_threads:
+        # only settable before the first parallel op runs
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            print ('interop threads already set, keeping {}'.format(
+                torch.get_num_interop_threads()))
+    return _device
+
+
+def get():
+    """ the configured device, configured from the environment on first use """
+    if _device is None:
+        configure()
+    return _device
+
+
+def pin_memory():
+    return get().type == 'cuda'
+
+
+def load(path):
+    """ torch.load onto the configured device, for checkpoints saved on gpu """
+    return torch.load(path, map_location=get())
@@ -10,10 +10,12 @@ from torch import nn
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
 
 
 def load_args():
@@ -35,6 +37,7 @@ def load_args():
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--use_aux', default=False, type=str)
     parser.add_argument('--model', default='small', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
 
     args = parser.parse_args()
     return args
@@ -65,36 +68,16 @@ class AuxDz(nn.Module):
         return x
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target, val=False):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    correct = None
-    if val:
-        pred = out.data.max(1, keepdim=True)[1]
-        correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 def train(args):
     
     torch.manual_seed(8734)
     
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
-    Aux = AuxDz(args).cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
+    Aux = AuxDz(args).to(device.get())
     print (netE, W1, W2, W3, Aux)#netD)
 
     optimE = optim.Adam(netE.parameters(), lr=.0005, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -110,8 +93,8 @@ def train(args):
     mnist_train, mnist_test = datagen.load_mnist(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -156,7 +139,7 @@ def train(args):
                 # split latent space into chunks -- each representing a class
                 factors = torch.split(codes[1], args.z//10, 1)
                 for y, factor in enumerate(factors):
-                    target = (torch.ones(args.batch_size, dtype=torch.long) * y).cuda()
+                    target = (torch.ones(args.batch_size, dtype=torch.long) * y).to(device.get())
                     aux_pred = Aux(factor)
                     aux_loss = F.cross_entropy(aux_pred, target)
                     aux_loss.backward(retain_graph=True)
@@ -164,7 +147,7 @@ def train(args):
                 #frozen_params([Aux])
                 #free_params([netE, W1, W2, W3])
             
-            correct, loss = train_clf(args, [l1, l2, l3], data, target, val=True)
+            correct, loss = population.train_clf(args, [l1, l2, l3], data, target)
             scaled_loss = args.beta*loss
             scaled_loss.backward()
             optimE.step()
@@ -192,7 +175,7 @@ def train(args):
                     l2 = W2(codes[1]).mean(0)
                     l3 = W3(codes[2]).mean(0)
                     min_loss_batch = 10.
-                    correct, loss = train_clf(args, [l1, l2, l3], data, y, val=True)
+                    correct, loss = population.train_clf(args, [l1, l2, l3], data, y)
                     test_acc += correct.item()
                     test_loss += loss.item()
                 test_loss /= len(mnist_test.dataset)
@@ -0,0 +1,159 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+"""
+Running statistics of an ensemble's predictions on one data batch. Logits
+come in a chunk of members at a time, (K, B, C) as EnsembleEvaluator
+returns them, and nothing per member is kept, so memory is O(B x C)
+however many networks are sampled:
+
+    stats = EnsembleStats()
+    for _ in range(n // 100):
+        stats.update(evaluator.sample(pool, 100, data))
+    score = stats.mutual_information()
+
+Softmax mean and variance are merged Welford style (Chan et al.), the
+predictive distribution is kept as a running log-sum-exp of member log
+probabilities, and argmax votes as a (B, C) histogram.
+adaptive_entropy keeps sampling only for the inputs whose predictive
+entropy is not yet pinned down, for OOD scoring.
+"""
+
+
+class EnsembleStats(object):
+    def __init__(self, covariance=False):
+        self.covariance = covariance
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.log_sum = None
+        self.entropy_sum = None
+        self.votes = None
+        self.cm2 = None
+
+    def update(self, logits):
+        """ logits: (K, B, C) for K members, or (B, C) for one """
+        logits = logits.detach().float()
+        if logits.dim() == 2:
+            logits = logits.unsqueeze(0)
+        k, b, c = logits.shape
+        logp = F.log_softmax(logits, -1)
+        p = logp.exp()
+        mean = p.mean(0)
+        m2 = (p - mean).pow(2).sum(0)
+        cm2 = None
+        if self.covariance:
+            d = p - mean
+            cm2 = torch.einsum('kbi,kbj->bij', d, d)
+        log_sum = torch.logsumexp(logp, 0)
+        entropy_sum = -(p * logp).sum(-1).sum(0)
+        # votes of member i on image j land in bin j * C + label
+        bins = logits.argmax(-1) + torch.arange(b, device=logits.device) * c
+        votes = torch.bincount(bins.view(-1), minlength=b * c).view(b, c)
+        self._merge(k, mean, m2, log_sum, entropy_sum, votes, cm2)
+        return self
+
+    def merge(self, other):
+        """ fold in the stats of another disjoint set of members on the same batch """
+        if other.n:
+            self._merge(other.n, other.mean, other.m2, other.log_sum,
+                    other.entropy_sum, other.votes, other.cm2)
+        return self
+
+    def _merge(self, k, mean, m2, log_sum, entropy_sum, votes, cm2=None):
+        if not self.n:
+            self.n, self.mean, self.m2 = k, mean.clone(), m2.clone()
+            self.log_sum, self.entropy_sum = log_sum.clone(), entropy_sum.clone()
+            self.votes = votes.clone()
+            if self.covariance:
+                self.cm2 = cm2.clone()
+            return
+        n = self.n + k
+        delta = mean - self.mean
+        if self.covariance:
+            self.cm2 += cm2 + delta.unsqueeze(2) * delta.unsqueeze(1) * (self.n * k / n)
+        self.mean += delta * (k / n)
+        self.m2 += m2 + delta.pow(2) * (self.n * k / n)
+        self.log_sum = torch.logaddexp(self.log_sum, log_sum)
+        self.entropy_sum += entropy_sum
+        self.votes += votes
+        self.n = n
+
+    def select(self, idx):
+        """ the stats of a subset of the batch, idx: index or mask over B """
+        sub = EnsembleStats(self.covariance)
+        sub.n = self.n
+        for name in ['mean', 'm2', 'log_sum', 'entropy_sum', 'votes', 'cm2']:
+            value = getattr(self, name)
+            setattr(sub, name, None if value is None else value[idx])
+        return sub
+
+    def variance(self, unbiased=True):
+        """ per image, per class variance of the member softmax, (B, C) """
+        return self.m2 / max(self.n - int(unbiased), 1)
+
+    def log_predictive(self):
+        """ log of the ensemble mean softmax, (B, C) """
+        return self.log_sum - math.log(self.n)
+
+    def predictive_entropy(self):
+        """ entropy of the mean prediction, (B,) """
+        logp = self.log_predictive()
+        return -(logp.exp() * logp).sum(-1)
+
+    def expected_entropy(self):
+        """ mean entropy of the members, (B,) """
+        return self.entropy_sum / self.n
+
+    def entropy_stderr(self):
+        """
+        standard error of predictive_entropy by the delta method, (B,);
+        needs covariance=True. H(p) has gradient -(log p + 1) and the
+        mean softmax has covariance cov / n.
+        """
+        g = -(self.log_predictive() + 1)
+        cov = self.cm2 / max(self.n - 1, 1)
+        var = torch.einsum('bi,bij,bj->b', g, cov, g) / self.n
+        return var.clamp(min=0).sqrt()
+
+    def mutual_information(self):
+        """ predictive minus expected entropy, the disagreement part, (B,) """
+        return (self.predictive_entropy() - self.expected_entropy()).clamp(min=0)
+
+    def mode(self):
+        """ majority label and its vote count, both (B,) """
+        count, label = self.votes.max(1)
+        return label, count
+
+    def vote_entropy(self):
+        """ entropy (nats) of the argmax label histogram, (B,) """
+        p = self.votes.float() / self.n
+        return -(p * torch.log(p.clamp(min=1e-30))).sum(-1)
+
+
+def adaptive_entropy(evaluator, pool, data, tol, step=10, min_n=10, max_n=200, z=1.96):
+    """
+    predictive entropy per input with as few sampled networks as it takes:
+    step more members from pool are evaluated on the inputs whose z * stderr
+    is still above tol, until max_n. Converged inputs leave the batch.
+    Returns the entropies and the members used, both (B,)
+    """
+    b = data.size(0)
+    ent = torch.zeros(b, device=data.device)
+    used = torch.zeros(b, dtype=torch.long, device=data.device)
+    active = torch.arange(b, device=data.device)
+    stats = EnsembleStats(covariance=True)
+    while active.numel():
+        stats.update(evaluator.sample(pool, min(step, max_n - stats.n), data))
+        if stats.n < min(min_n, max_n):
+            continue
+        done = z * stats.entropy_stderr() <= tol
+        if stats.n >= max_n:
+            done.fill_(True)
+        ent[active[done]] = stats.predictive_entropy()[done].to(ent.dtype)
+        used[active[done]] = stats.n
+        keep = ~done
+        active, data, stats = active[keep], data[keep], stats.select(keep)
+    return ent, used
@@ -10,6 +10,7 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torchvision import datasets, transforms
 from torch.autograd import Variable
+import device
 import utils
 
 # Training settings
@@ -87,7 +88,7 @@ def train(model, grad=False, ft=False):
     for epoch in range(1):
         model.train()
         for batch_idx, (data, target) in enumerate(train_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
@@ -104,7 +105,7 @@ def test(model, epoch=None, grad=False):
     correct = 0
     criterion = nn.CrossEntropyLoss()
     for data, target in test_loader:
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         output = model(data)
         if grad is False:
             test_loss += criterion(output, target).item() # sum up batch loss
@@ -207,9 +208,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = Small().cuda()
+        model = Small().to(device.get())
     elif args.net == 'small2':
-        model = Small2().cuda()
+        model = Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -240,7 +241,7 @@ def load_models(args):
     print (len(paths))
     for i, path in enumerate(natpaths):
         print ("loading model {}".format(path))
-        ckpt = torch.load(path)
+        ckpt = device.load(path)
         ckpts.append(ckpt)
         model.load_state_dict(ckpt['state'])
         #model.load_state_dict(ckpt)
@@ -10,7 +10,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
+import device
 import utils
+import sampler
 import models.mnist_clf as models
 import models.models_mnist_small as hyper
 import datagen
@@ -45,10 +47,7 @@ def load_args():
 
 
 def train(args, model, grad=False):
-    if args.dataset =='mnist':
-        train_loader, _ = datagen.load_mnist(args)
-    elif args.dataset == 'fashion_mnist':
-        train_loader, _ = datagen.load_fashion_mnist(args)
+    train_loader, _ = datagen.loaders(args, args.dataset)
     train_loss, train_acc = 0., 0.
     criterion = nn.CrossEntropyLoss()
     if args.ft:
@@ -60,7 +59,7 @@ def train(args, model, grad=False):
     for epoch in range(args.epochs):
         model.train()
         for batch_idx, (data, target) in enumerate(train_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
@@ -72,15 +71,13 @@ def train(args, model, grad=False):
 
 def test(args, model, epoch=None, grad=False):
     model.eval()
-    if args.dataset =='mnist':
-        _, test_loader = datagen.load_mnist(args)
-    elif args.dataset == 'fashion_mnist':
-        _, test_loader = datagen.load_fashion_mnist(args)
+    # held on device once, reused for every model evaluated
+    test_loader = datagen.device_split(args, args.dataset)
     test_loss = 0
     correct = 0.
     criterion = nn.CrossEntropyLoss()
     for data, target in test_loader:
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         output = model(data)
         if grad is False:
             test_loss += criterion(output, target).item() # sum up batch loss
@@ -117,11 +114,7 @@ def normalize(x):
 # gradient under a new network for each iteration: IFGSM
 # One step attacks, do they transfer, no need to modify attacks here. 
 def sample_fmodel(hypernet, arch):
-    w_batch = utils.sample_hypernet(hypernet)
-    rand = np.random.randint(32)
-    sample_w = (w_batch[0][rand], w_batch[1][rand], w_batch[2][rand])
-    model = utils.weights_to_clf(sample_w, arch, args.stat['layer_names'])
-    model.eval()
+    model = sampler.pooled(hypernet, args).next_model(arch)
     fmodel = attacks.load_model(model)
     return model, fmodel
 
@@ -138,33 +131,19 @@ def model_func(model):
 def sample_func(hypernet, arch):
     import torch
     import numpy as np
-    import torch.distributions.multivariate_normal as N
     def sample_hypernet(hypernet):
         netE, W1, W2, W3 = hypernet
-        mean, cov = torch.zeros(300), torch.eye(300)
-        D = N.MultivariateNormal(mean, cov)
-        z = D.sample((32,)).cuda()
-        z.requires_grad = True
+        z = utils.sample_d(utils.create_d(300), 32)
         codes = netE(z)
         l1 = W1(codes[0])
         l2 = W2(codes[1])
         l3 = W3(codes[2])
         return l1, l2, l3
 
-    def weights_to_clf(weights, model):
-        state = model.state_dict()
-        layers = zip(model.lnames, weights)
-        for i, (name, params) in enumerate(layers):
-            name = name + '.weight'
-            loader = state[name]
-            state[name] = params.detach()
-            model.load_state_dict(state)
-        return model
-    
     w_batch = sample_hypernet(hypernet)
     rand = np.random.randint(32)
     sample_w = (w_batch[0][rand], w_batch[1][rand], w_batch[2][rand])
-    model = weights_to_clf(sample_w, arch)
+    model = utils.weights_to_clf(sample_w, arch, arch.lnames)
     model.eval()
     return model
 
@@ -199,8 +178,8 @@ def attack_batch_hyper(data, target, fmodel, eps, attack, hypernet, arch):
     if adv == []:
         adv_batch, target_batch = None, None
     else:
-        adv_batch = torch.stack(adv).cuda()
-        target_batch = torch.stack(y).cuda()
+        adv_batch = torch.stack(adv).to(device.get())
+        target_batch = torch.stack(y).to(device.get())
     return adv_batch, target_batch, adv_preds
 
 
@@ -234,8 +213,8 @@ def attack_batch_ensemble(data, target, eps, attack, ensemble):
     if adv == []:
         adv_batch, target_batch = None, None
     else:
-        adv_batch = torch.stack(adv).cuda()
-        target_batch = torch.stack(y).cuda()
+        adv_batch = torch.stack(adv).to(device.get())
+        target_batch = torch.stack(y).to(device.get())
     return adv_batch, target_batch, adv_preds
 
 
@@ -251,7 +230,7 @@ def run_adv_hyper(args, hypernet):
         total_adv = 0
         acc, _accs, _vars, _stds = [], [], [], []
         for idx, (data, target) in enumerate(test_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             adv_batch, target_batch, _ = attack_batch_hyper(
                     data, target, fmodel_base, eps, fgs, hypernet, arch)
             if adv_batch is None:
@@ -324,7 +303,7 @@ def run_adv_model(args, models):
         _accs, _vars, _stds = [], [], []
         pred_labels = []
         for data, target in test_loader:
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             adv_batch, target_batch, _ = attack_batch_ensemble(data, target, eps, fgs, fmodels)
             if adv_batch is None:
                 continue
@@ -368,9 +347,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = models.Small().cuda()
+        model = models.Small().to(device.get())
     elif args.net == 'small2':
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -391,7 +370,7 @@ def adv_attack(args, path):
         models = []
         for path in paths:
             model = get_network(args)
-            model.load_state_dict(torch.load(path))
+            model.load_state_dict(device.load(path))
             models.append(model.eval())
         run_adv_model(args, models)
     
@@ -439,7 +418,7 @@ def load_models(args, path):
                     #extract_weights_all(args, model, i)
             print(accs, losses)
         else:
-            ckpt = torch.load(path)
+            ckpt = device.load(path)
             state = ckpt['state_dict']
             try:
                 model.load_state_dict()
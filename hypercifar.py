@@ -9,15 +9,17 @@ from torch import nn
 from torch import autograd
 from torch import optim
 from torch.nn import functional as F
-import torch.distributions.multivariate_normal as N
 import pprint
 
+import device
+import latent
 import models.models_cifar as models
 
 import ops
 import utils
 import netdef
 import datagen
+import population
 
 
 def load_args():
@@ -45,48 +47,24 @@ def sample_x(args, gen, id, grad=True):
         res = []
         for i, g in enumerate(gen):
             data = next(g)
-            x = (torch.tensor(data, requires_grad=grad)).cuda()
+            x = (torch.tensor(data, requires_grad=grad)).to(device.get())
             res.append(x.view(*args.shapes[i]))
     else:
         data = next(gen)
-        x = torch.tensor(data, requires_grad=grad).cuda()
+        x = torch.tensor(data, requires_grad=grad).to(device.get())
         res = x.view(*args.shapes[id])
     return res
 
 
 def sample_z(args, grad=True):
-    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).cuda()
+    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).to(device.get())
     return z
 
 
 def sample_z_like(shape, scale=1., grad=True):
-    mean = torch.zeros(shape[1])
-    cov = torch.eye(shape[1])
-    D = N.MultivariateNormal(mean, cov)
-    z = D.sample((shape[0],)).cuda()
-    return scale * z
+    return latent.sample_z_like(shape, scale, grad=False)
  
 
-# hard code the two layer net
-def train_clf(args, Z, data, target, val=False):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    x = F.relu(F.conv2d(data, Z[0]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[1]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[2]))
-    x = F.max_pool2d(x, 2, 2)
-    x = x.view(x.size(0), -1)
-    x = F.relu(F.linear(x, Z[3]))
-    x = F.linear(x, Z[4])
-    loss = F.cross_entropy(x, target)
-    correct = None
-    if val:
-        pred = x.data.max(1, keepdim=True)[1]
-        correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
 
 def batch_zero_grad(nets):
     for module in nets:
@@ -126,13 +104,13 @@ def train(args):
     
     torch.manual_seed(8734)
     
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    W4 = models.GeneratorW4(args).cuda()
-    W5 = models.GeneratorW5(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    W4 = models.GeneratorW4(args).to(device.get())
+    W5 = models.GeneratorW5(args).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2, W3, W4, W5, netD)
 
     optimE = optim.Adam(netE.parameters(), lr=5e-3, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -149,8 +127,8 @@ def train(args):
     cifar_train, cifar_test = datagen.load_cifar(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -203,7 +181,7 @@ def train(args):
             frozen_params([netD])
             free_params([netE, W1, W2, W3, W4, W5])
 
-            correct, loss = train_clf(args, [l1, l2, l3, l4, l5], data, target, val=True)
+            correct, loss = population.train_clf(args, [l1, l2, l3, l4, l5], data, target)
             scaled_loss = args.beta * loss
             scaled_loss.backward()
                
@@ -232,7 +210,7 @@ def train(args):
                     l3 = W3(codes[2]).mean(0)
                     l4 = W4(codes[3]).mean(0)
                     l5 = W5(codes[4]).mean(0)
-                    correct, loss = train_clf(args, [l1, l2, l3, l4, l5], data, y, val=True)
+                    correct, loss = population.train_clf(args, [l1, l2, l3, l4, l5], data, y)
                     test_acc += correct.item()
                     total_correct += correct.item()
                     test_loss += loss.item()
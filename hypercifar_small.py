@@ -11,19 +11,25 @@ from torch import nn
 from torch import autograd
 from torch import optim
 from torch.nn import functional as F
-import torch.distributions.multivariate_normal as N
 import pprint
 
+import device
+import latent
 import ops
 import utils
 import netdef
 import datagen
+import population
+import prefetch
+from models.bank import GeneratorBank
 
 
 def load_args():
 
     parser = argparse.ArgumentParser(description='param-wgan')
     parser.add_argument('-z', '--z', default=256, type=int, help='latent space width')
+    parser.add_argument('--device', default='', type=str, help='cuda or cpu, default cuda if available')
+    parser.add_argument('--threads', default=0, type=int, help='cpu intra-op threads, 0 for torch default')
     parser.add_argument('-ze', '--ze', default=512, type=int, help='encoder dimension')
     parser.add_argument('-g', '--gp', default=10, type=int, help='gradient penalty')
     parser.add_argument('-b', '--batch_size', default=32, type=int)
@@ -37,6 +43,16 @@ def load_args():
     parser.add_argument('--scratch', default=False, type=bool)
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--hidden', default=False, type=bool)
+    parser.add_argument('--population_chunk', default=0, type=int, help='target nets per backward chunk, 0 for the whole population')
+    parser.add_argument('--recompute', default='', type=str, help='target activation recompute: layer or chunk')
+    parser.add_argument('--recompute_chunk', default=8, type=int, help='target nets per checkpoint in chunk mode')
+    parser.add_argument('--loader', default='tensor', type=str, help='tensor (uint8 + batched augmentation) or torchvision')
+    parser.add_argument('--cache_dir', default='', type=str, help='preprocessed split cache (.npy), off if empty and $HYPER_CACHE unset')
+    parser.add_argument('--classes', default='', type=str, help='train and test on these classes only, e.g. 0,1,2')
+    parser.add_argument('--per_class', default=None, type=int, help='cap on training samples per class')
+    parser.add_argument('--fraction', default=None, type=float, help='stratified fraction of each training class')
+    parser.add_argument('--seed', default=None, type=int, help='seed for batch order and augmentation')
+    parser.add_argument('--noise_bank', default=0, type=int, help='latent rows drawn ahead per refill, 0 draws every step')
     args = parser.parse_args()
     return args
 
@@ -187,7 +203,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         x = self.relu(self.linear1(x))
         x = self.relu(self.linear2(x))
         x = self.linear3(x)
@@ -201,56 +217,24 @@ def sample_x(args, gen, id, grad=True):
         res = []
         for i, g in enumerate(gen):
             data = next(g)
-            x = (torch.tensor(data, requires_grad=grad)).cuda()
+            x = (torch.tensor(data, requires_grad=grad)).to(device.get())
             res.append(x.view(*args.shapes[i]))
     else:
         data = next(gen)
-        x = torch.tensor(data, requires_grad=grad).cuda()
+        x = torch.tensor(data, requires_grad=grad).to(device.get())
         res = x.view(*args.shapes[id])
     return res
 
 
 def sample_z(args, grad=True):
-    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).cuda()
+    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).to(device.get())
     return z
 
 
 def sample_z_like(shape, scale=1., grad=True):
-    mean = torch.zeros(shape[1])
-    cov = torch.eye(shape[1])
-    D = N.MultivariateNormal(mean, cov)
-    z = D.sample((shape[0],)).cuda()
-    return scale * z
+    return latent.sample_z_like(shape, scale, grad=False)
  
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    x = F.relu(F.conv2d(data, Z[0]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[1]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[2]))
-    x = F.max_pool2d(x, 2, 2)
-    x = x.view(x.size(0), -1)
-    x = F.relu(F.linear(x, Z[3]))
-    x = F.linear(x, Z[4])
-    loss = F.cross_entropy(x, target)
-    pred = x.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
-def batch_zero_grad(nets):
-    for module in nets:
-        module.zero_grad()
-
-
-def batch_update_optim(optimizers):
-    for optim in optimizers:
-        optim.step()
-
 def free_params(nets):
     for module in nets:
         for p in module.parameters():
@@ -280,21 +264,17 @@ def train(args):
     
     torch.manual_seed(8734)
     
-    netE = Encoder(args).cuda()
-    W1 = GeneratorW1(args).cuda()
-    W2 = GeneratorW2(args).cuda()
-    W3 = GeneratorW3(args).cuda()
-    W4 = GeneratorW4(args).cuda()
-    W5 = GeneratorW5(args).cuda()
-    netD = DiscriminatorZ(args).cuda()
+    netE = Encoder(args).to(device.get())
+    W1 = GeneratorW1(args).to(device.get())
+    W2 = GeneratorW2(args).to(device.get())
+    W3 = GeneratorW3(args).to(device.get())
+    W4 = GeneratorW4(args).to(device.get())
+    W5 = GeneratorW5(args).to(device.get())
+    netD = DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2, W3, W4, W5, netD)
+    bank = GeneratorBank([W1, W2, W3, W4, W5], args.shapes).to(device.get())
 
-    optimE = optim.Adam(netE.parameters(), lr=5e-3, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW1 = optim.Adam(W1.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW2 = optim.Adam(W2.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW3 = optim.Adam(W3.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW4 = optim.Adam(W4.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW5 = optim.Adam(W5.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
+    optimG = ops.OptimGroup([netE, bank], [5e-3, 1e-4], betas=(0.5, 0.9), weight_decay=1e-4)
     optimD = optim.Adam(netD.parameters(), lr=5e-5, betas=(0.5, 0.9), weight_decay=1e-4)
     
     best_test_acc, best_test_loss = 0., np.inf
@@ -305,8 +285,8 @@ def train(args):
         cifar_train, cifar_test = datagen.load_cifar_hidden(args, c_idx)
     else:
         cifar_train, cifar_test = datagen.load_cifar(args)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -316,13 +296,15 @@ def train(args):
             x = sample_z_like((e_batch_size, args.ze))
             z = sample_z_like((e_batch_size, args.z))
             codes = netE(x)
+            e_loss = 0.
             for i, code in enumerate(codes):
                 code = code.view(e_batch_size, args.z)
                 mean_loss, cov_loss = pretrain_loss(code, z)
                 loss = mean_loss + cov_loss
-                loss.backward(retain_graph=True)
-            optimE.step()
-            netE.zero_grad()
+                e_loss = e_loss + loss
+            e_loss.backward()
+            optimG.step()
+            optimG.zero_grad()
             print ('Pretrain Enc iter: {}, Mean Loss: {}, Cov Loss: {}'.format(
                 j, mean_loss.item(), cov_loss.item()))
             final = loss.item()
@@ -331,46 +313,36 @@ def train(args):
                 break
 
     print ('==> Begin Training')
+    # encoder input and D prior are drawn ahead, next to the data batch
+    x_dist = latent.create_d(args.ze, bank=args.noise_bank)
+    z_dist = latent.create_d(args.z, bank=args.noise_bank)
+    samplers = {
+            'x': lambda: latent.sample_d(x_dist, args.batch_size, grad=False),
+            'z': lambda: latent.sample_d(z_dist, args.batch_size * len(args.shapes), grad=False),
+            }
     for _ in range(args.epochs):
-        for batch_idx, (data, target) in enumerate(cifar_train):
-            batch_zero_grad([netE, W1, W2, W3, W4, W5, netD])
-            z = sample_z_like((args.batch_size, args.ze,))
-            codes = netE(z)
-            l1 = W1(codes[0])
-            l2 = W2(codes[1])
-            l3 = W3(codes[2])
-            l4 = W4(codes[3])
-            l5 = W5(codes[4])
+        for batch_idx, (data, target, noise) in enumerate(prefetch.Prefetcher(cifar_train, samplers)):
+            ops.batch_zero_grad([netE, bank, netD])
+            codes = netE(noise['x'])
+            l1, l2, l3, l4, l5 = bank(codes)
             
             # Z Adversary 
+            # codes are detached, the D step never touches the generator graph
             free_params([netD])
-            frozen_params([netE, W1, W2, W3, W4, W5])
-            for code in codes:
-                noise = sample_z_like((args.batch_size, args.z))
-                d_real = netD(noise)
-                d_fake = netD(code)
-                d_real_loss = -1 * torch.log((1-d_real).mean())
-                d_fake_loss = -1 * torch.log(d_fake.mean())
-                d_real_loss.backward(retain_graph=True)
-                d_fake_loss.backward(retain_graph=True)
-                d_loss = d_real_loss + d_fake_loss
+            d_loss = ops.z_adversary_loss(netD, codes, noise['z'])
+            d_loss.backward()
             optimD.step()
 
             # Generator (Mean test)
             frozen_params([netD])
-            free_params([netE, W1, W2, W3, W4, W5])
-            for (g1, g2, g3, g4, g5) in zip(l1, l2, l3, l4, l5):
-                correct, loss = train_clf(args, [g1, g2, g3, g4, g5], data, target)
-                scaled_loss = args.beta * loss
-                scaled_loss.backward(retain_graph=True)
+            correct, loss = population.backward_clf(args, [l1, l2, l3, l4, l5], data, target, args.beta)
                
-            optimE.step(); optimW1.step(); optimW2.step()
-            optimW3.step(); optimW4.step(); optimW5.step()
-            loss = loss.item()
+            optimG.step()
+            loss = loss.mean().item()
             
             """ Update Statistics """
             if batch_idx % 50 == 0:
-                acc = (correct / 1) 
+                acc = correct.float().mean().item()
                 norm_z1 = np.linalg.norm(l1.data)
                 norm_z2 = np.linalg.norm(l2.data)
                 norm_z3 = np.linalg.norm(l3.data)
@@ -378,7 +350,7 @@ def train(args):
                 norm_z5 = np.linalg.norm(l5.data)
                 print ('**************************************')
                 print ('Mean Test: Enc, Dz, Lscale: {} test'.format(args.beta))
-                print ('Acc: {}, G Loss: {}, D Loss: {}'.format(acc, loss, d_loss))
+                print ('Acc: {}, G Loss: {}, D Loss: {}'.format(acc, loss, d_loss.item()))
                 print ('Filter norm: ', norm_z1)
                 print ('Filter norm: ', norm_z2)
                 print ('Filter norm: ', norm_z3)
@@ -390,23 +362,19 @@ def train(args):
             if batch_idx % 100 == 0:
                 test_acc = 0.
                 test_loss = 0.
-                for i, (data, y) in enumerate(cifar_test):
-                    z = sample_z_like((args.batch_size, args.ze,))
-                    w1_code, w2_code, w3_code, w4_code, w5_code = netE(z)
-                    l1 = W1(w1_code)
-                    l2 = W2(w2_code)
-                    l3 = W3(w3_code)
-                    l4 = W4(w4_code)
-                    l5 = W5(w5_code)
-                    for (g1, g2, g3, g4, g5) in zip(l1, l2, l3, l4, l5):
-                        correct, loss = train_clf(args, [g1, g2, g3, g4, g5], data, y)
-                        test_acc += correct.item()
-                        test_loss += loss.item()
+                with torch.no_grad():
+                    for i, (data, y) in enumerate(cifar_test):
+                        z = sample_z_like((args.batch_size, args.ze,))
+                        l1, l2, l3, l4, l5 = bank(netE(z))
+                        correct, loss = population.train_clf(
+                                args, [l1, l2, l3, l4, l5], data, y)
+                        test_acc += correct.sum().item()
+                        test_loss += loss.sum().item()
                 test_loss /= len(cifar_test.dataset) * args.batch_size
                 test_acc /= len(cifar_test.dataset) * args.batch_size
                 print ('Test Accuracy: {}, Test Loss: {}'.format(test_acc, test_loss))
                 if test_loss < best_test_loss or test_acc > best_test_acc:
-                    utils.save_hypernet_cifar(args, [netE, W1, W2, W3, W4, W5, netD], test_acc)
+                    utils.save_hypernet_cifar(args, [netE] + bank.unstack() + [netD], test_acc)
                     print ('==> new best stats, saving')
                     if test_loss < best_test_loss:
                         best_test_loss = test_loss
@@ -419,6 +387,7 @@ def train(args):
 if __name__ == '__main__':
 
     args = load_args()
+    device.configure(args.device, threads=args.threads)
     modeldef = netdef.nets()[args.model]
     pprint.pprint (modeldef)
     # log some of the netstat quantities so we don't subscript everywhere
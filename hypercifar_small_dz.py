@@ -6,7 +6,6 @@ import argparse
 import numpy as np
 import torch
 import torchvision
-import torch.distributions.multivariate_normal as N
 
 from glob import glob
 from torch import nn
@@ -14,9 +13,12 @@ from torch import optim
 from torch.nn import functional as F
 from torchvision import datasets, transforms
 
+import device
+import latent
 import utils
 import netdef
 import datagen_xai as datagen
+import population
 import matplotlib.pyplot as plt
 
 
@@ -189,7 +191,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         x = self.relu(self.linear1(x))
         x = self.relu(self.linear2(x))
         x = self.linear3(x)
@@ -203,26 +205,22 @@ def sample_x(args, gen, id, grad=True):
         res = []
         for i, g in enumerate(gen):
             data = next(g)
-            x = (torch.tensor(data, requires_grad=grad)).cuda()
+            x = (torch.tensor(data, requires_grad=grad)).to(device.get())
             res.append(x.view(*args.shapes[i]))
     else:
         data = next(gen)
-        x = torch.tensor(data, requires_grad=grad).cuda()
+        x = torch.tensor(data, requires_grad=grad).to(device.get())
         res = x.view(*args.shapes[id])
     return res
 
 
 def sample_z(args, grad=True):
-    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).cuda()
+    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).to(device.get())
     return z
 
 
 def sample_z_like(shape, scale=1., grad=True):
-    mean = torch.zeros(shape[1])
-    cov = torch.eye(shape[1])
-    D = N.MultivariateNormal(mean, cov)
-    z = D.sample((shape[0],)).cuda()
-    return scale * z
+    return latent.sample_z_like(shape, scale, grad=False)
  
 
 def load_cifar(args):
@@ -253,33 +251,6 @@ def load_cifar(args):
     return trainloader, testloader
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target, val=False):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    def moments(x):
-        m = x.detach().view(x.shape[1], -1)
-        m.requires_grad = False
-        return (torch.mean(m, 1), torch.var(m, 1))
-    x = F.relu(F.conv2d(data, Z[0]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[1]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[2]))
-    x = F.max_pool2d(x, 2, 2)
-    x = x.view(x.size(0), -1)
-    x = F.relu(F.linear(x, Z[3]))
-    x = F.linear(x, Z[4])
-    
-    loss = F.cross_entropy(x, target)
-    correct = None
-    if val:
-        pred = x.data.max(1, keepdim=True)[1]
-        correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    # (clf_acc, clf_loss), (oa, ol) = ops.clf_loss(args, Z)
-    return (correct, loss)
-
-
 def batch_zero_grad(nets):
     for module in nets:
         module.zero_grad()
@@ -318,13 +289,13 @@ def train(args):
     
     torch.manual_seed(8734)
     
-    netE = Encoder(args).cuda()
-    W1 = GeneratorW1(args).cuda()
-    W2 = GeneratorW2(args).cuda()
-    W3 = GeneratorW3(args).cuda()
-    W4 = GeneratorW4(args).cuda()
-    W5 = GeneratorW5(args).cuda()
-    netD = DiscriminatorZ(args).cuda()
+    netE = Encoder(args).to(device.get())
+    W1 = GeneratorW1(args).to(device.get())
+    W2 = GeneratorW2(args).to(device.get())
+    W3 = GeneratorW3(args).to(device.get())
+    W4 = GeneratorW4(args).to(device.get())
+    W5 = GeneratorW5(args).to(device.get())
+    netD = DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2, W3, W4, W5, netD)
 
     optimE = optim.Adam(netE.parameters(), lr=0.005, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -357,8 +328,8 @@ def train(args):
         w4_gen = utils.inf_train_gen(base_gen[3])
         w5_gen = utils.inf_train_gen(base_gen[4])
 
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     if args.use_x:
         X = sample_x(args, [w1_gen, w2_gen, w3_gen, w4_gen, w5_gen], 0)
         X = list(map(lambda x: (x+1e-10).float(), X))
@@ -427,7 +398,7 @@ def train(args):
             for code in codes:
                 d_costs.append(netD(code))
             d_loss = torch.cat(d_costs).mean()
-            correct, loss = train_clf(args, [l1, l2, l3, l4, l5], data, target, val=True)
+            correct, loss = population.train_clf(args, [l1, l2, l3, l4, l5], data, target)
             scaled_loss = (args.beta*loss) + d_loss
             scaled_loss.backward()
                
@@ -467,7 +438,7 @@ def train(args):
                     l5 = W5(w5_code).mean(0)
                     min_loss_batch = 10.
                     z_test = [l1, l2, l3, l4, l5]
-                    correct, loss = train_clf(args, [l1, l2, l3, l4, l5], data, y, val=True)
+                    correct, loss = population.train_clf(args, [l1, l2, l3, l4, l5], data, y)
                     if loss.item() < min_loss_batch:
                         min_loss_batch = loss.item()
                         z_test = [l1, l2, l3, l4, l5]
@@ -13,11 +13,14 @@ from torch import optim
 from torch.nn import functional as F
 import pprint
 
+import device
+import latent
 import ops
 import plot
 import utils
 import netdef
 import datagen
+import population
 import matplotlib.pyplot as plt
 
 
@@ -227,7 +230,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         if x.shape[-1] > self.lcd*self.lcd:
             x = self.relu(self.linear0(x))
         x = self.relu(self.linear1(x))
@@ -242,23 +245,22 @@ def sample_x(args, gen, id, grad=True):
         res = []
         for i, g in enumerate(gen):
             data = next(g)
-            x = (torch.tensor(data, requires_grad=grad)).cuda()
+            x = (torch.tensor(data, requires_grad=grad)).to(device.get())
             res.append(x.view(*args.shapes[i]))
     else:
         data = next(gen)
-        x = torch.tensor(data, requires_grad=grad).cuda()
+        x = torch.tensor(data, requires_grad=grad).to(device.get())
         res = x.view(*args.shapes[id])
     return res
 
 
 def sample_z(args, grad=True):
-    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).cuda()
+    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).to(device.get())
     return z
 
 
 def sample_z_like(shape, grad=True):
-    z = torch.randn(*shape, requires_grad=grad).cuda()
-    return z
+    return latent.sample_z_like(shape, grad=grad)
  
 
 def train_ae(args, netG, netE, x):
@@ -306,33 +308,6 @@ def load_cifar():
     return trainloader, testloader
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target, val=False):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    def moments(x):
-        m = x.detach().view(x.shape[1], -1)
-        m.requires_grad = False
-        return (torch.mean(m, 1), torch.var(m, 1))
-    x = F.relu(F.conv2d(data, Z[0]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[1]))
-    x = F.max_pool2d(x, 2, 2)
-    x = F.relu(F.conv2d(x, Z[2]))
-    x = F.max_pool2d(x, 2, 2)
-    x = x.view(x.size(0), -1)
-    x = F.relu(F.linear(x, Z[3]))
-    x = F.linear(x, Z[4])
-    
-    loss = F.cross_entropy(x, target)
-    correct = None
-    if val:
-        pred = x.data.max(1, keepdim=True)[1]
-        correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    # (clf_acc, clf_loss), (oa, ol) = ops.clf_loss(args, Z)
-    return (correct, loss)
-
-
 def cov(x, y):
     mean_x = torch.mean(x, dim=0, keepdim=True)
     mean_y = torch.mean(y, dim=0, keepdim=True)
@@ -358,12 +333,12 @@ def train(args):
     
     torch.manual_seed(8734)
     
-    netE = Encoder(args).cuda()
-    W1 = GeneratorW1(args).cuda()
-    W2 = GeneratorW2(args).cuda()
-    W3 = GeneratorW3(args).cuda()
-    W4 = GeneratorW4(args).cuda()
-    W5 = GeneratorW5(args).cuda()
+    netE = Encoder(args).to(device.get())
+    W1 = GeneratorW1(args).to(device.get())
+    W2 = GeneratorW2(args).to(device.get())
+    W3 = GeneratorW3(args).to(device.get())
+    W4 = GeneratorW4(args).to(device.get())
+    W5 = GeneratorW5(args).to(device.get())
     print (netE, W1, W2, W3, W4, W5)
 
     optimizerE = optim.Adam(netE.parameters(), lr=3e-4, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -394,8 +369,8 @@ def train(args):
         w4_gen = utils.inf_train_gen(base_gen[3])
         w5_gen = utils.inf_train_gen(base_gen[4])
 
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     if args.use_x:
         X = sample_x(args, [w1_gen, w2_gen, w3_gen, w4_gen, w5_gen], 0)
         X = list(map(lambda x: (x+1e-10).float(), X))
@@ -413,7 +388,7 @@ def train(args):
                 if args.use_x:
                     acc, loss = 0., 0.
                     for i, (x, y) in enumerate(cifar_test):
-                        correct, l = train_clf(args, X, x, y, val=True)
+                        correct, l = population.train_clf(args, X, x, y)
                         acc += correct.item()
                         loss += l.item()
                     print ("Functional Net: ", acc/len(cifar_test.dataset),
@@ -428,7 +403,7 @@ def train(args):
             l5 = W5(code)#.contiguous().view(args.batch_size, -1))
             
             for (z1, z2, z3, z4, z5) in zip(l1, l2, l3, l4, l5):
-                correct, loss = train_clf(args, [z1, z2, z3, z4, z5], data, target, val=True)
+                correct, loss = population.train_clf(args, [z1, z2, z3, z4, z5], data, target)
                 scaled_loss = (1000*loss) #+ z1_loss + z2_loss + z3_loss
                 scaled_loss.backward(retain_graph=True)
             optimizerE.step()
@@ -471,7 +446,7 @@ def train(args):
                     min_loss_batch = 10.
                     z_test = [l1[0], l2[0], l3[0], l4[0], l5[0]]
                     for (z1, z2, z3, z4, z5) in zip(l1, l2, l3, l4, l5):
-                        correct, loss = train_clf(args, [z1, z2, z3, z4, z5], data, y, val=True)
+                        correct, loss = population.train_clf(args, [z1, z2, z3, z4, z5], data, y)
                         if loss.item() < min_loss_batch:
                             min_loss_batch = loss.item()
                             z_test = [z1, z2, z3, z4, z5]
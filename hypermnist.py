@@ -7,16 +7,29 @@ import numpy as np
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
+import prefetch
+from models.bank import GeneratorBank
 
 
 def load_args():
 
     parser = argparse.ArgumentParser(description='param-wgan')
     parser.add_argument('--z', default=128, type=int, help='latent space width')
+    parser.add_argument('--device', default='', type=str, help='cuda or cpu, default cuda if available')
+    parser.add_argument('--threads', default=0, type=int, help='cpu intra-op threads, 0 for torch default')
+    parser.add_argument('--latent_seed', default=None, type=int, help='seed for the encoder and D noise streams')
+    parser.add_argument('--noise_bank', default=0, type=int, help='latent rows drawn ahead per refill, 0 draws every step')
+    parser.add_argument('--loader', default='tensor', type=str, help='tensor (decoded once) or torchvision')
+    parser.add_argument('--cache_dir', default='', type=str, help='preprocessed split cache (.npy), off if empty and $HYPER_CACHE unset')
+    parser.add_argument('--classes', default='', type=str, help='train and test on these classes only, e.g. 0,1,2')
+    parser.add_argument('--per_class', default=None, type=int, help='cap on training samples per class')
+    parser.add_argument('--fraction', default=None, type=float, help='stratified fraction of each training class')
     parser.add_argument('--ze', default=300, type=int, help='encoder dimension')
     parser.add_argument('--batch_size', default=32, type=int)
     parser.add_argument('--epochs', default=200000, type=int)
@@ -30,53 +43,45 @@ def load_args():
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--model', default='small', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
+    parser.add_argument('--tile', default=4096, type=int, help='chunked model: weights per tile')
+    parser.add_argument('--chunk_dim', default=64, type=int, help='chunked model: tile embedding width')
+    parser.add_argument('--chunk_batch', default=64, type=int, help='chunked model: tiles per checkpointed chunk, 0 for all')
+    parser.add_argument('--population_chunk', default=0, type=int, help='target nets per backward chunk, 0 for the whole population')
 
     args = parser.parse_args()
     return args
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss on target architecture """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    pred = out.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
-    print (netE, W1, W2, W3)
-
-    optimE = optim.Adam(netE.parameters(), lr=5e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW1 = optim.Adam(W1.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW2 = optim.Adam(W2.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
-    optimW3 = optim.Adam(W3.parameters(), lr=1e-4, betas=(0.5, 0.9), weight_decay=1e-4)
+    netE = models.Encoder(args).to(device.get())
+    if args.model == 'chunked':
+        netG = models.ChunkedGenerator(args).to(device.get())
+        print (netE, netG)
+    else:
+        W1 = models.GeneratorW1(args).to(device.get())
+        W2 = models.GeneratorW2(args).to(device.get())
+        W3 = models.GeneratorW3(args).to(device.get())
+        print (netE, W1, W2, W3)
+        netG = GeneratorBank([W1, W2, W3], args.shapes).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
+
+    optimG = ops.OptimGroup([netE, netG], [5e-4, 1e-4], betas=(0.5, 0.9), weight_decay=1e-4)
     optimD = optim.Adam(netD.parameters(), lr=1e-5, betas=(0.5, 0.9), weight_decay=1e-4)
     
     best_test_acc, best_test_loss = 0., np.inf
     args.best_loss, args.best_acc = best_test_loss, best_test_acc
 
     mnist_train, mnist_test = datagen.load_mnist(args)
-    x_dist = utils.create_d(args.ze)
-    z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    # separate counter based streams when seeded, see latent.py
+    x_dist = utils.create_d(args.ze, args.latent_seed, stream=0, bank=args.noise_bank)
+    z_dist = utils.create_d(args.z, args.latent_seed, stream=1, bank=args.noise_bank)
+    # the prefetch thread owns x_dist and z_dist, the test ensembles draw from their own
+    test_dist = utils.create_d(args.ze, args.latent_seed, stream=4)
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -86,13 +91,15 @@ def train(args):
             x = utils.sample_d(x_dist, e_batch_size)
             z = utils.sample_d(z_dist, e_batch_size)
             codes = netE(x)
+            e_loss = 0.
             for i, code in enumerate(codes):
                 code = code.view(e_batch_size, args.z)
                 mean_loss, cov_loss = ops.pretrain_loss(code, z)
                 loss = mean_loss + cov_loss
-                loss.backward(retain_graph=True)
-            optimE.step()
-            netE.zero_grad()
+                e_loss = e_loss + loss
+            e_loss.backward()
+            optimG.step()
+            optimG.zero_grad()
             print ('Pretrain Enc iter: {}, Mean Loss: {}, Cov Loss: {}'.format(
                 j, mean_loss.item(), cov_loss.item()))
             final = loss.item()
@@ -101,42 +108,30 @@ def train(args):
                 break
 
     print ('==> Begin Training')
+    # encoder input and D prior are drawn ahead, next to the data batch
+    samplers = {'x': lambda: utils.sample_d(x_dist, args.batch_size, grad=False)}
+    if args.use_d:
+        samplers['z'] = lambda: utils.sample_d(z_dist,
+                args.batch_size * len(args.shapes), grad=False)
     for _ in range(args.epochs):
-        for batch_idx, (data, target) in enumerate(mnist_train):
-            ops.batch_zero_grad([netE, W1, W2, W3, netD])
-            z = utils.sample_d(x_dist, args.batch_size)
-            codes = netE(z)
-            l1 = W1(codes[0])
-            l2 = W2(codes[1])
-            l3 = W3(codes[2])
+        for batch_idx, (data, target, noise) in enumerate(prefetch.Prefetcher(mnist_train, samplers)):
+            ops.batch_zero_grad([netE, netG, netD])
+            codes = netE(noise['x'])
+            layers = netG(codes)
             if args.use_d:
+                # codes are detached, the D step never touches the generator graph
                 ops.free_params([netD])
-                ops.frozen_params([netE, W1, W2, W3])
-                for code in codes:
-                    noise = utils.sample_d(z_dist, args.batch_size)
-                    d_real = netD(noise)
-                    d_fake = netD(code)
-                    d_real_loss = -1 * torch.log((1-d_real).mean())
-                    d_fake_loss = -1 * torch.log(d_fake.mean())
-                    d_real_loss.backward(retain_graph=True)
-                    d_fake_loss.backward(retain_graph=True)
-                    d_loss = d_real_loss + d_fake_loss
+                d_loss = ops.z_adversary_loss(netD, codes, noise['z'])
+                d_loss.backward()
                 optimD.step()
                 ops.frozen_params([netD])
-                ops.free_params([netE, W1, W2, W3])
             
-            for (g1, g2, g3) in zip(l1, l2, l3):
-                correct, loss = train_clf(args, [g1, g2, g3], data, target)
-                scaled_loss = args.beta * loss
-                scaled_loss.backward(retain_graph=True)
-            optimE.step()
-            optimW1.step()
-            optimW2.step()
-            optimW3.step()
-            loss = loss.item()
+            correct, loss = population.backward_clf(args, layers, data, target, args.beta)
+            optimG.step()
+            loss = loss.mean().item()
                 
             if batch_idx % 50 == 0:
-                acc = (correct / 1) 
+                acc = correct.float().mean().item()
                 print ('**************************************')
                 print ('{} MNIST Test, beta: {}'.format(args.model, args.beta))
                 print ('Acc: {}, Loss: {}'.format(acc, loss))
@@ -148,28 +143,24 @@ def train(args):
                 test_acc = 0.
                 test_loss = 0.
                 ensemble = 5
-                for i, (data, y) in enumerate(mnist_test):
-                    en1, en2, en3 = [], [], []
-                    for i in range(ensemble):
-                        z = utils.sample_d(x_dist, args.batch_size)
-                        codes = netE(z)
-                        rand = np.random.randint(32)
-                        en1.append(W1(codes[0])[rand])
-                        en2.append(W2(codes[1])[rand])
-                        en3.append(W3(codes[2])[rand])
-                    g1 = torch.stack(en1).mean(0)
-                    g2 = torch.stack(en2).mean(0)
-                    g3 = torch.stack(en3).mean(0)
-                    correct, loss = train_clf(args, [g1, g2, g3], data, y)
-                    test_acc += correct.item()
-                    test_loss += loss.item()
+                with torch.no_grad():
+                    for i, (data, y) in enumerate(mnist_test):
+                        en = []
+                        for i in range(ensemble):
+                            z = utils.sample_d(test_dist, args.batch_size)
+                            codes = netE(z)
+                            rand = np.random.randint(32)
+                            en.append([l[rand] for l in netG(codes)])
+                        Z = [torch.stack(l).mean(0) for l in zip(*en)]
+                        correct, loss = population.train_clf(args, Z, data, y)
+                        test_acc += correct.item()
+                        test_loss += loss.item()
                 test_loss /= len(mnist_test.dataset)
                 test_acc /= len(mnist_test.dataset)
                 """
-                for (g1, g2, g3) in zip(l1, l2, l3):
-                        correct, loss = train_clf(args, [g1, g2, g3], data, y)
-                        test_acc += correct.item()
-                        test_loss += loss.item()
+                correct, loss = population.train_clf(args, layers, data, y)
+                test_acc += correct.sum().item()
+                test_loss += loss.sum().item()
                 test_loss /= len(mnist_test.dataset) * args.batch_size
                 test_acc /= len(mnist_test.dataset) * args.batch_size
                 """
@@ -178,7 +169,10 @@ def train(args):
                     print ('==> new best stats, saving')
                     #utils.save_clf(args, z_test, test_acc)
                     if test_acc > .95:
-                        utils.save_hypernet_mnist(args, [netE, W1, W2, W3], test_acc)
+                        if args.model == 'chunked':
+                            utils.save_hypernet_mnist(args, [netE, netG], test_acc)
+                        else:
+                            utils.save_hypernet_mnist(args, [netE] + netG.unstack(), test_acc)
                     if test_loss < best_test_loss:
                         best_test_loss = test_loss
                         args.best_loss = test_loss
@@ -190,12 +184,15 @@ def train(args):
 if __name__ == '__main__':
 
     args = load_args()
+    device.configure(args.device, threads=args.threads)
     if args.model == 'small':
         import models.models_mnist_small as models
     elif args.model == 'nobn':
         import models.models_mnist_nobn as models
     elif args.model == 'full':
         import models.models_mnist as models
+    elif args.model == 'chunked':
+        import models.chunked as models
     else:
         raise NotImplementedError
 
@@ -7,10 +7,12 @@ import numpy as np
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
 
 
 def load_args():
@@ -30,37 +32,20 @@ def load_args():
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--model', default='small', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
 
     args = parser.parse_args()
     return args
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss on target architecture """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    pred = out.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2, W3)
 
     optimE = optim.Adam(netE.parameters(), lr=.0005, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -75,8 +60,8 @@ def train(args):
     mnist_train, mnist_test = datagen.load_mnist(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -86,11 +71,13 @@ def train(args):
             x = utils.sample_d(x_dist, e_batch_size)
             z = utils.sample_d(z_dist, e_batch_size)
             codes = netE(x)
+            e_loss = 0.
             for i, code in enumerate(codes):
                 code = code.view(e_batch_size, args.z)
                 mean_loss, cov_loss = ops.pretrain_loss(code, z)
                 loss = mean_loss + cov_loss
-                loss.backward(retain_graph=True)
+                e_loss = e_loss + loss
+            e_loss.backward()
             optimE.step()
             netE.zero_grad()
             print ('Pretrain Enc iter: {}, Mean Loss: {}, Cov Loss: {}'.format(
@@ -113,33 +100,25 @@ def train(args):
             l3 = W3(codes[2])
 
             if args.use_d:
+                # codes are detached, the D step never touches the generator graph
                 ops.free_params([netD])
-                ops.frozen_params([netE, W1, W2, W3])
-                for code in codes:
-                    noise = utils.sample_d(z_dist, args.batch_size)
-                    d_real = netD(noise)
-                    d_fake = netD(code)
-                    d_real_loss = -1 * torch.log((1-d_real).mean())
-                    d_fake_loss = -1 * torch.log(d_fake.mean())
-                    d_real_loss.backward(retain_graph=True)
-                    d_fake_loss.backward(retain_graph=True)
-                    d_loss = d_real_loss + d_fake_loss
+                noise = utils.sample_d(z_dist, args.batch_size * len(codes), grad=False)
+                d_loss = ops.z_adversary_loss(netD, codes, noise)
+                d_loss.backward()
                 optimD.step()
                 ops.frozen_params([netD])
-                ops.free_params([netE, W1, W2, W3])
             
-            for (g1, g2, g3) in zip(l1, l2, l3):
-                correct, loss = train_clf(args, [g1, g2, g3], data, target)
-                scaled_loss = args.beta * loss
-                scaled_loss.backward(retain_graph=True)
+            correct, loss = population.train_clf(args, [l1, l2, l3], data, target)
+            scaled_loss = args.beta * loss.sum()
+            scaled_loss.backward()
             optimE.step()
             optimW1.step()
             optimW2.step()
             optimW3.step()
-            loss = loss.item()
+            loss = loss.mean().item()
                 
             if batch_idx == 0:
-                acc = (correct / 1) 
+                acc = correct.float().mean().item()
                 print ('**************************************')
                 print ('{} MNIST Test, beta: {}'.format(args.model, args.beta))
                 print ('Acc: {}, Loss: {}'.format(acc, loss))
@@ -156,16 +135,15 @@ def train(args):
                     l1 = W1(codes[0])
                     l2 = W2(codes[1])
                     l3 = W3(codes[2])
-                    for (g1, g2, g3) in zip(l1, l2, l3):
-                        correct, loss = train_clf(args, [g1, g2, g3], data, y)
-                        test_acc += correct.item()
-                        test_loss += loss.item()
+                    correct, loss = population.train_clf(args, [l1, l2, l3], data, y)
+                    test_acc += correct.sum().item()
+                    test_loss += loss.sum().item()
                 test_loss /= len(mnist_test.dataset) * args.batch_size
                 test_acc /= len(mnist_test.dataset) * args.batch_size
                 print ('Test Accuracy: {}, Test Loss: {}'.format(test_acc, test_loss))
                 if test_loss < best_test_loss or test_acc > best_test_acc:
                     print ('==> new best stats, saving')
-                    utils.save_clf(args, [g1, g2, g3], test_acc)
+                    utils.save_clf(args, [l1[-1], l2[-1], l3[-1]], test_acc)
                     utils.save_hypernet_mnist(args, [netE, W1, W2, W3], test_acc)
                     if test_loss < best_test_loss:
                         best_test_loss = test_loss
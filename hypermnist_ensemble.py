@@ -7,10 +7,12 @@ import numpy as np
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
 
 
 def load_args():
@@ -30,6 +32,7 @@ def load_args():
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--model', default='small', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
 
     args = parser.parse_args()
     return args
@@ -38,19 +41,8 @@ def load_args():
 # hard code the two layer net
 def train_clf(args, layers, data, target):
     """ calc classifier loss on target architecture """
-    linear_out = []
-    for Z in zip(*layers):
-        data, target = data.cuda(), target.cuda()
-        out = F.conv2d(data, Z[0], stride=1)
-        out = F.leaky_relu(out)
-        out = F.max_pool2d(out, 2, 2)
-        out = F.conv2d(out, Z[1], stride=1)
-        out = F.leaky_relu(out)
-        out = F.max_pool2d(out, 2, 2)
-        out = out.view(-1, 512)
-        out = F.linear(out, Z[2])
-        linear_out.append(out)
-    out = torch.stack(linear_out).mean(0)
+    data, target = data.to(device.get()), target.to(device.get())
+    out = population.compile_net(args.stat)(layers, data).mean(0)
     loss = F.cross_entropy(out, target)
     pred = out.data.max(1, keepdim=True)[1]
     correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
@@ -60,11 +52,11 @@ def train_clf(args, layers, data, target):
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2, W3)
 
     optimE = optim.Adam(netE.parameters(), lr=5e-4, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -79,8 +71,8 @@ def train(args):
     mnist_train, mnist_test = datagen.load_mnist(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -8,10 +8,12 @@ from torch import nn
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
 import models.models_mnist_info as models
 
 
@@ -33,29 +35,12 @@ def load_args():
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--model', default='info', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
     parser.add_argument('--disc_iters', default=5, type=int)
 
     args = parser.parse_args()
     return args
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    pred = out.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 """ conditional distribution Q(x|c) """
 class Q(nn.Module):
     def __init__(self):
@@ -85,7 +70,7 @@ class Q(nn.Module):
 
 def sample_categorical(shape):
     c = np.random.multinomial(1, 10*[.1], size=shape)
-    c = torch.tensor(c, dtype=torch.float32).cuda()
+    c = torch.tensor(c, dtype=torch.float32).to(device.get())
     return c
 
 
@@ -96,7 +81,7 @@ def to_categorical(y, cols):
 
 
 def MI_loss(args, qx, c):
-    z = torch.zeros(args.batch_size, args.z).cuda()
+    z = torch.zeros(args.batch_size, args.z).to(device.get())
     xentropy = torch.mean(-torch.sum(c * torch.log(qx + 1e-8), dim=1))
     entropy = torch.mean(-torch.sum(c * torch.log(c + 1e-8), dim=1))
     #categorical_loss = F.cross_entropy()
@@ -108,7 +93,7 @@ def MI_loss(args, qx, c):
 
 def embedding_clf(args, layer, netQ, c):
     out = netQ(layer, clf=True)
-    target = torch.tensor([torch.max(i, 0)[1].item() for i in c]).cuda()
+    target = torch.tensor([torch.max(i, 0)[1].item() for i in c]).to(device.get())
     loss = F.cross_entropy(out, target.long())
     pred = out.data.max(1, keepdim=True)[1]
     acc = pred.eq(target.data.view_as(pred)).long().cpu().sum()
@@ -118,12 +103,12 @@ def embedding_clf(args, layer, netQ, c):
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    #netQ = models.DiscriminatorQ(args).cuda()
-    netQ = Q().cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    #netQ = models.DiscriminatorQ(args).to(device.get())
+    netQ = Q().to(device.get())
     print (netE, W1, W2, W3, netQ)
 
     optimE = optim.Adam(netE.parameters(), lr=.0005, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -139,8 +124,8 @@ def train(args):
     mnist_train, mnist_test = datagen.load_mnist(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -200,19 +185,17 @@ def train(args):
             if args.use_d:
                 for code in codes:
                     d_fake.append(netD(code))
-            for i, (g1, g2, g3) in enumerate(zip(l1, l2, l3)):
-                correct, loss = train_clf(args, [g1, g2, g3], data, target)
-                clf_loss.append(loss)
-                if args.use_d:
-                    scaled_loss = args.beta * (loss + d_fake[i])
-                else:
-                    scaled_loss = args.beta * loss
-                scaled_loss.backward(retain_graph=True)
+            correct, clf_loss = population.train_clf(args, [l1, l2, l3], data, target)
+            scaled_loss = args.beta * clf_loss.sum()
+            if args.use_d:
+                scaled_loss = scaled_loss + args.beta * torch.cat(d_fake).sum()
+            # the MI step below runs W2 again on the same codes
+            scaled_loss.backward(retain_graph=True)
             optimE.step()
             optimW1.step()
             optimW2.step()
             optimW3.step()
-            loss = torch.stack(clf_loss).mean().item()
+            loss = clf_loss.mean().item()
 
             """ MI loss """
             # want to maximize the mutaul information between the labels and a given filter
@@ -230,7 +213,7 @@ def train(args):
             optimQ.step()
 
             if batch_idx % 50 == 0:
-                acc = (correct / 1) 
+                acc = correct.float().mean().item()
                 print ('**************************************')
                 print ('{} MNIST Test, beta: {}'.format(args.model, args.beta))
                 print ('Acc: {}, Loss: {}, MI loss: {}, Q loss: {}'.format(acc,
@@ -251,15 +234,14 @@ def train(args):
                     idx = [0, 0] + [i for i in range(10) for _ in range(3)]
                     c = np.zeros([args.batch_size, 10])
                     c[range(args.batch_size), idx] = 1
-                    c = torch.tensor(c, dtype=torch.float32).cuda()
+                    c = torch.tensor(c, dtype=torch.float32).to(device.get())
                     l1 = W1(codes[0])
                     l2 = W2(codes[1], c)
                     l3 = W3(codes[2])
-                    for (g1, g2, g3) in zip(l1, l2, l3):
-                        correct, loss = train_clf(args, [g1, g2, g3], data, y)
-                        test_acc += correct.item()
-                        test_loss += loss.item()
-
+                    correct, loss = population.train_clf(args, [l1, l2, l3], data, y)
+                    test_acc += correct.sum().item()
+                    test_loss += loss.sum().item()
+                    for g2 in l2:
                         q_correct, q_loss = embedding_clf(args, g2, netQ, c)
                         q_test_acc += q_correct.item()
                         q_test_loss += q_loss.item()
@@ -10,10 +10,12 @@ from torch import nn
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import ops
 import utils
 import netdef
 import datagen
+import population
 import models.models_mnist_info as models
 
 
@@ -36,6 +38,7 @@ def load_args():
     parser.add_argument('--exp', default='0', type=str)
     parser.add_argument('--use_d', default=False, type=str)
     parser.add_argument('--model', default='info', type=str)
+    parser.add_argument('--head_rank', default='', type=str, help='per generator head rank, e.g. 0,8,0 (0 is dense)')
     parser.add_argument('--disc_iters', default=5, type=int)
     parser.add_argument('--factors', default=2, type=int)
 
@@ -66,24 +69,6 @@ class Q(nn.Module):
         return x
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    pred = out.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 def weight_init(m):
     classname = m.__class__.__name__
     if classname.find('Linear') != -1:
@@ -95,14 +80,14 @@ def weight_init(m):
 
 def sample_categorical(shape):
     c = np.random.multinomial(1, 10*[.1], size=shape)
-    c = torch.tensor(c, dtype=torch.float32).cuda()
+    c = torch.tensor(c, dtype=torch.float32).to(device.get())
     return c
 
 
 def to_categorical(y, cols):
     y_cat = np.zeros((y.shape[0], cols))
     y_cat[range(y.shape[0]), y] = 1
-    return torch.tensor(y_cat, dtype=torch.float).cuda()
+    return torch.tensor(y_cat, dtype=torch.float).to(device.get())
 
 
 def MI_loss(args, y, y_pred, c, c_pred):
@@ -116,7 +101,7 @@ def MI_loss(args, y, y_pred, c, c_pred):
 
 def embedding_clf(args, layer, netQ, c):
     out = netQ(layer, clf=True)
-    target = torch.tensor([torch.max(i, 0)[1].item() for i in c]).cuda()
+    target = torch.tensor([torch.max(i, 0)[1].item() for i in c]).to(device.get())
     loss = F.cross_entropy(out, target.long())
     pred = out.data.max(1, keepdim=True)[1]
     acc = pred.eq(target.data.view_as(pred)).long().cpu().sum()
@@ -137,11 +122,11 @@ def sample_layer(args, netE, W2, rows):
     # Static sample
     static_y = to_categorical(np.array([num for _ in range(10)
         for num in range(10)])[:32], cols=10)
-    static_z = torch.zeros(args.batch_size, args.ze).cuda()
-    static_c = torch.zeros((args.batch_size, args.factors)).cuda()
+    static_z = torch.zeros(args.batch_size, args.ze).to(device.get())
+    static_c = torch.zeros((args.batch_size, args.factors)).to(device.get())
     static_netcode = netE(static_z)[1]
 
-    z = torch.randn((args.batch_size, args.ze)).cuda()
+    z = torch.randn((args.batch_size, args.ze)).to(device.get())
     netcode = netE(z)[1]
 
     static_sample = W2(netcode, static_y, static_c)
@@ -150,8 +135,8 @@ def sample_layer(args, netE, W2, rows):
     zeros = np.zeros((32, 1))
     c_varied = np.repeat(np.linspace(-1, 1, 10)[:, np.newaxis], 3, 0)
     c_varied = np.append([[0, 0]], c_varied)[:, np.newaxis]
-    c1 = torch.tensor(np.concatenate((c_varied, zeros), -1)).float().cuda()
-    c2 = torch.tensor(np.concatenate((zeros, c_varied), -1)).float().cuda()
+    c1 = torch.tensor(np.concatenate((c_varied, zeros), -1)).float().to(device.get())
+    c2 = torch.tensor(np.concatenate((zeros, c_varied), -1)).float().to(device.get())
     sample1 = W2(static_netcode, static_y, c1)[np.random.randint(10)]
     sample2 = W2(static_netcode, static_y, c2)[np.random.randint(10)]
     return sample1, sample2
@@ -160,12 +145,12 @@ def sample_layer(args, netE, W2, rows):
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorQ(args).cuda()
-    netQ = Q().cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    netD = models.DiscriminatorQ(args).to(device.get())
+    netQ = Q().to(device.get())
     print (netE, W1, W2, W3, netD, netQ)
 
     netD.apply(weight_init)
@@ -187,8 +172,8 @@ def train(args):
     real_filters = x_gen()
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
    
     if args.pretrain_e:
         j = 0
@@ -218,15 +203,15 @@ def train(args):
         for batch_idx, (data, target) in enumerate(mnist_train):
             
             """ generate encoding """
-            valid = torch.ones((args.batch_size, 1), dtype=torch.float32, requires_grad=False).cuda()
-            fake = torch.zeros((args.batch_size, 1), dtype=torch.float32, requires_grad=False).cuda()
-            real = torch.tensor(next(real_filters), requires_grad=True).cuda()
+            valid = torch.ones((args.batch_size, 1), dtype=torch.float32, requires_grad=False).to(device.get())
+            fake = torch.zeros((args.batch_size, 1), dtype=torch.float32, requires_grad=False).to(device.get())
+            real = torch.tensor(next(real_filters), requires_grad=True).to(device.get())
             labels = to_categorical(target.numpy(), cols=10)
 
             ops.batch_zero_grad([optimE, optimW1, optimW2, optimW3])
             z = utils.sample_d(x_dist, args.batch_size)
-            c = torch.tensor(np.random.uniform(-1, 1, (args.batch_size, args.factors))).float().cuda()
-            ycat = torch.tensor(np.random.randint(0, 10, args.batch_size)).long().cuda()
+            c = torch.tensor(np.random.uniform(-1, 1, (args.batch_size, args.factors))).float().to(device.get())
+            ycat = torch.tensor(np.random.randint(0, 10, args.batch_size)).long().to(device.get())
             y = to_categorical(ycat, cols=10).float()
             codes = netE(z)
 
@@ -238,7 +223,7 @@ def train(args):
             clf_loss = []
             for i, (g1, g2, g3) in enumerate(zip(l1, l2, l3)):
                 #d_valid, d_y, d_f = netD(g2)
-                correct, loss = train_clf(args, [g1, g2, g3], data, target)
+                correct, loss = population.train_clf(args, [g1, g2, g3], data, target)
                 clf_loss.append(loss)
                 #adv_loss = F.mse_loss(d_valid, valid)
                 scaled_loss = args.beta * loss# + adv_loss
@@ -268,10 +253,10 @@ def train(args):
             optimQ.zero_grad()
             optimE.zero_grad()
             sampled_labels = np.random.randint(0, 10, args.batch_size)
-            gt_labels = torch.tensor(sampled_labels, requires_grad=False).long().cuda()
+            gt_labels = torch.tensor(sampled_labels, requires_grad=False).long().to(device.get())
             label = to_categorical(sampled_labels, cols=10)
             #code = torch.tensor(np.random.normal(-1, 1,
-            #    (args.batch_size, args.factors))).float().cuda()
+            #    (args.batch_size, args.factors))).float().to(device.get())
             z = utils.sample_d(x_dist, args.batch_size)
             embedding = netE(z)[1]
             
@@ -317,15 +302,15 @@ def train(args):
                     z = utils.sample_d(x_dist, args.batch_size)
                     codes = netE(z)
                     c = torch.tensor(np.random.uniform(-1, 1,
-                            (args.batch_size, args.factors))).float().cuda()
+                            (args.batch_size, args.factors))).float().to(device.get())
                     y = to_categorical(np.random.randint(0, 10, args.batch_size),
-                            cols=10).float().cuda()
+                            cols=10).float().to(device.get())
                     l1 = W1(codes[0])
                     l2 = W2(codes[1], y)#, c)
                     l3 = W3(codes[2])
                     #sample1, sample2 = sample_layer(args, netE, W2, 10)
                     for (g1, g2, g3) in zip(l1, l2, l3):
-                        correct, loss = train_clf(args, [g1, g2, g3], data, target)
+                        correct, loss = population.train_clf(args, [g1, g2, g3], data, target)
                         test_acc += correct.item()
                         test_loss += loss.item()
 
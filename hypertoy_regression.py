@@ -7,12 +7,14 @@ import numpy as np
 from torch import optim
 from torch.nn import functional as F
 
+import device
 import models.toy as models
 
 import ops
 import utils
 import netdef
 import datagen
+import population
 
 
 def load_args():
@@ -37,32 +39,14 @@ def load_args():
     return args
 
 
-# hard code the two layer net
-def train_clf(args, Z, data, target):
-    """ calc classifier loss on target architecture """
-    data, target = data.cuda(), target.cuda()
-    out = F.conv2d(data, Z[0], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = F.conv2d(out, Z[1], stride=1)
-    out = F.leaky_relu(out)
-    out = F.max_pool2d(out, 2, 2)
-    out = out.view(-1, 512)
-    out = F.linear(out, Z[2])
-    loss = F.cross_entropy(out, target)
-    pred = out.data.max(1, keepdim=True)[1]
-    correct = pred.eq(target.data.view_as(pred)).long().cpu().sum()
-    return (correct, loss)
-
-
 def train(args):
     
     torch.manual_seed(8734)
-    netE = models.Encoder(args).cuda()
-    W1 = models.GeneratorW1(args).cuda()
-    W2 = models.GeneratorW2(args).cuda()
-    W3 = models.GeneratorW3(args).cuda()
-    netD = models.DiscriminatorZ(args).cuda()
+    netE = models.Encoder(args).to(device.get())
+    W1 = models.GeneratorW1(args).to(device.get())
+    W2 = models.GeneratorW2(args).to(device.get())
+    W3 = models.GeneratorW3(args).to(device.get())
+    netD = models.DiscriminatorZ(args).to(device.get())
     print (netE, W1, W2)
 
     optimE = optim.Adam(netE.parameters(), lr=5e-4, betas=(0.5, 0.9), weight_decay=1e-4)
@@ -77,8 +61,8 @@ def train(args):
     mnist_train, mnist_test = datagen.load_mnist(args)
     x_dist = utils.create_d(args.ze)
     z_dist = utils.create_d(args.z)
-    one = torch.FloatTensor([1]).cuda()
-    mone = (one * -1).cuda()
+    one = torch.FloatTensor([1]).to(device.get())
+    mone = (one * -1).to(device.get())
     print ("==> pretraining encoder")
     j = 0
     final = 100.
@@ -128,7 +112,7 @@ def train(args):
                 ops.free_params([netE, W1, W2, W3])
             
             for (g1, g2, g3) in zip(l1, l2, l3):
-                correct, loss = train_clf(args, [g1, g2, g3], data, target)
+                correct, loss = population.train_clf(args, [g1, g2, g3], data, target)
                 scaled_loss = args.beta * loss
                 scaled_loss.backward(retain_graph=True)
             optimE.step()
@@ -162,14 +146,14 @@ def train(args):
                     g1 = torch.stack(en1).mean(0)
                     g2 = torch.stack(en2).mean(0)
                     g3 = torch.stack(en3).mean(0)
-                    correct, loss = train_clf(args, [g1, g2, g3], data, y)
+                    correct, loss = population.train_clf(args, [g1, g2, g3], data, y)
                     test_acc += correct.item()
                     test_loss += loss.item()
                 test_loss /= len(mnist_test.dataset)
                 test_acc /= len(mnist_test.dataset)
                 """
                 for (g1, g2, g3) in zip(l1, l2, l3):
-                        correct, loss = train_clf(args, [g1, g2, g3], data, y)
+                        correct, loss = population.train_clf(args, [g1, g2, g3], data, y)
                         test_acc += correct.item()
                         test_loss += loss.item()
                 test_loss /= len(mnist_test.dataset) * args.batch_size
@@ -0,0 +1,148 @@
+import math
+import threading
+import torch
+
+import device
+
+
+"""
+Latent noise for the encoder input and the discriminator prior.
+Isotropic draws N(0, I) straight on the configured device, no covariance
+matrix and no host copy. Seeded samplers are counter based: draw k of
+(seed, stream) always comes from the same generator state, whatever else
+was drawn in between or in which process, so runs and evaluations replay.
+NoiseBank hands out slices of one pre-drawn block and refills it in a
+single draw, or replays a fixed block for evaluation.
+For ensemble estimates Antithetic draws (z, -z) pairs and Sobol maps
+scrambled Sobol points through the inverse normal cdf; efficiency() says
+how many i.i.d. draws either is worth for a given statistic.
+Isotropic and NoiseBank both have .sample((n,)), so utils.sample_d takes
+either in place of the old MultivariateNormal. sample() is atomic on every
+sampler (a lock per instance), so a prefetch thread and the main loop can
+share one, though a seeded stream is only reproducible from one thread.
+"""
+
+
+_mask = (1 << 64) - 1
+
+
+def _mix(*keys):
+    """ splitmix64 over the keys, a 63 bit seed """
+    h = 0
+    for k in keys:
+        h = (h + 0x9E3779B97F4A7C15 + (k & _mask)) & _mask
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _mask
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _mask
+        h = h ^ (h >> 31)
+    return h >> 1
+
+
+class Isotropic(object):
+    def __init__(self, dim, seed=None, stream=0):
+        self.dim = dim
+        self.seed = seed
+        self.stream = stream
+        self.counter = 0
+        self.generator = None
+        self.lock = threading.Lock()
+        if seed is not None:
+            self.generator = torch.Generator(device=device.get())
+
+    def sample(self, shape=(1,)):
+        n = shape[0] if isinstance(shape, (tuple, list, torch.Size)) else shape
+        with self.lock:
+            if self.generator is not None:
+                self.generator.manual_seed(_mix(self.seed, self.stream, self.counter))
+                self.counter += 1
+            return torch.randn(n, self.dim, device=device.get(), generator=self.generator)
+
+
+class NoiseBank(object):
+    def __init__(self, dim, size, seed=None, stream=0, fixed=False, mode='iid'):
+        self.dist = samplers[mode](dim, seed, stream)
+        self.size = size
+        self.fixed = fixed
+        self.lock = threading.Lock()
+        self.refill()
+
+    def refill(self):
+        self.block = self.dist.sample((self.size,))
+        self.pos = 0
+
+    def sample(self, shape=(1,)):
+        n = shape[0] if isinstance(shape, (tuple, list, torch.Size)) else shape
+        if n > self.size:
+            return self.dist.sample((n,))
+        with self.lock:
+            if self.pos + n > self.size:
+                if self.fixed:
+                    self.pos = 0
+                else:
+                    self.refill()
+            z = self.block[self.pos:self.pos+n]
+            self.pos += n
+            return z
+
+
+class Antithetic(Isotropic):
+    """ i.i.d. draws each followed by its negation, so every even length prefix is paired """
+    def sample(self, shape=(1,)):
+        n = shape[0] if isinstance(shape, (tuple, list, torch.Size)) else shape
+        z = super(Antithetic, self).sample(((n + 1) // 2,))
+        return torch.stack([z, -z], 1).view(-1, self.dim)[:n]
+
+
+class Sobol(object):
+    """ scrambled Sobol points through the inverse normal cdf, continues the sequence """
+    def __init__(self, dim, seed=None, stream=0):
+        self.dim = dim
+        seed = None if seed is None else _mix(seed, stream)
+        self.engine = torch.quasirandom.SobolEngine(dim, scramble=True, seed=seed)
+        self.lock = threading.Lock()
+
+    def sample(self, shape=(1,)):
+        n = shape[0] if isinstance(shape, (tuple, list, torch.Size)) else shape
+        with self.lock:
+            u = self.engine.draw(n)
+        u = u.clamp_(1e-7, 1 - 1e-7)
+        z = torch.erfinv(2 * u - 1) * math.sqrt(2)
+        return z.to(device.get(), torch.get_default_dtype())
+
+
+samplers = {'iid': Isotropic, 'antithetic': Antithetic, 'sobol': Sobol}
+
+
+def create_d(dim, seed=None, stream=0, mode='iid', bank=0):
+    """ bank: draw that many ahead and hand out slices, 0 draws per call """
+    if bank:
+        return NoiseBank(dim, bank, seed, stream, mode=mode)
+    return samplers[mode](dim, seed, stream)
+
+
+def sample_d(D, n, scale=1., grad=True):
+    # the product is always a fresh leaf, also for views into a bank
+    z = scale * D.sample((n,))
+    z.requires_grad = grad
+    return z
+
+
+def sample_z_like(shape, scale=1., grad=True):
+    z = torch.randn(*shape, device=device.get())
+    if scale != 1.:
+        z.mul_(scale)
+    z.requires_grad = grad
+    return z
+
+
+def efficiency(statistic, dim, n, repeats=20, modes=('iid', 'antithetic', 'sobol')):
+    """
+    variance of the estimate statistic(z) (z: n draws, returns a tensor)
+    over independently seeded repeats, per sampling mode; returns
+    {mode: (summed variance, i.i.d. draws needed for the same variance)}
+    """
+    var = {}
+    for mode in modes:
+        est = torch.stack([statistic(create_d(dim, seed=r, mode=mode).sample((n,)))
+            for r in range(repeats)])
+        var[mode] = est.var(0).sum().item()
+    return dict((m, (v, n * var['iid'] / max(v, 1e-30))) for m, v in var.items())
@@ -10,6 +10,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
+import device
 import utils
 import models.mnist_clf as models
 import models.models_mnist_small as hyper
@@ -35,10 +36,7 @@ def load_args():
 
 
 def train(args, model, grad=False):
-    if args.dataset =='mnist':
-        train_loader, _ = datagen.load_mnist(args)
-    elif args.dataset == 'fashion_mnist':
-        train_loader, _ = datagen.load_fashion_mnist(args)
+    train_loader, _ = datagen.loaders(args, args.dataset)
     train_loss, train_acc = 0., 0.
     criterion = nn.CrossEntropyLoss()
     if args.ft:
@@ -50,7 +48,7 @@ def train(args, model, grad=False):
     for epoch in range(args.epochs):
         model.train()
         for batch_idx, (data, target) in enumerate(train_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
@@ -62,15 +60,13 @@ def train(args, model, grad=False):
 
 def test(args, model, epoch=None, grad=False):
     model.eval()
-    if args.dataset =='mnist':
-        _, test_loader = datagen.load_mnist(args)
-    elif args.dataset == 'fashion_mnist':
-        _, test_loader = datagen.load_fashion_mnist(args)
+    # held on device once, reused for every model evaluated
+    test_loader = datagen.device_split(args, args.dataset)
     test_loss = 0
     correct = 0.
     criterion = nn.CrossEntropyLoss()
     for data, target in test_loader:
-        data, target = data.cuda(), target.cuda()
+        data, target = data.to(device.get()), target.to(device.get())
         output = model(data)
         if grad is False:
             test_loss += criterion(output, target).item() # sum up batch loss
@@ -175,9 +171,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = models.Small().cuda()
+        model = models.Small().to(device.get())
     elif args.net == 'small2':
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -225,7 +221,7 @@ def load_models(args, path):
                     #extract_weights_all(args, model, i)
             print(accs, losses)
         else:
-            ckpt = torch.load(path)
+            ckpt = device.load(path)
             state = ckpt['state_dict']
             try:
                 model.load_state_dict()
@@ -0,0 +1,178 @@
+import torch
+
+from torch import nn
+from torch.nn import functional as F
+
+
+"""
+Runs a list of per layer weight generators (linear1, bn1, ..., linearK)
+as one module. Generators with the same hidden widths are stacked into a
+group and their hidden layers run as one batched matmul, the per generator
+batchnorms as one batchnorm over the concatenated features (equivalent,
+the statistics are per feature anyway). Output heads of a group are stacked
+and zero padded when that wastes little, otherwise run one after another.
+
+The wrapped generators stay the reference for checkpoints: the bank copies
+their parameters in with stack() and writes them back with unstack(), so
+save_hypernet_mnist / save_hypernet_cifar see the usual W1..Wn state dicts.
+"""
+
+
+def _layers(module, prefix):
+    layers, i = [], 1
+    while hasattr(module, '{}{}'.format(prefix, i)):
+        layers.append(getattr(module, '{}{}'.format(prefix, i)))
+        i += 1
+    return layers
+
+
+def _activation(module):
+    if isinstance(module, nn.ELU):
+        return lambda x: F.elu(x, module.alpha)
+    if isinstance(module, nn.LeakyReLU):
+        return lambda x: F.leaky_relu(x, module.negative_slope)
+    return F.relu
+
+
+class _Group(nn.Module):
+    """ stacked hidden layers (and possibly heads) of same-width generators """
+    def __init__(self, generators, shapes, pad_ratio):
+        super(_Group, self).__init__()
+        g = len(generators)
+        hidden = [_layers(gen, 'linear')[:-1] for gen in generators]
+        bns = [_layers(gen, 'bn') for gen in generators]
+        self.act = _activation(getattr(generators[0], 'relu', None))
+        self.shapes = shapes
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        self.bn_weights = nn.ParameterList()
+        self.bn_biases = nn.ParameterList()
+        self.use_bn = []
+        for j, layer in enumerate(hidden[0]):
+            self.weights.append(nn.Parameter(torch.zeros(g, *layer.weight.shape)))
+            self.biases.append(nn.Parameter(torch.zeros(g, layer.out_features)))
+            use_bn = j < len(bns[0])
+            self.use_bn.append(use_bn)
+            if use_bn:
+                bn = bns[0][j]
+                self.momentum, self.eps = bn.momentum, bn.eps
+                self.bn_weights.append(nn.Parameter(torch.ones(g, bn.num_features)))
+                self.bn_biases.append(nn.Parameter(torch.zeros(g, bn.num_features)))
+                self.register_buffer('running_mean{}'.format(j),
+                        torch.zeros(g, bn.num_features))
+                self.register_buffer('running_var{}'.format(j),
+                        torch.ones(g, bn.num_features))
+                self.register_buffer('num_batches_tracked{}'.format(j),
+                        torch.zeros(g, dtype=torch.long))
+
+        heads = [_layers(gen, 'linear')[-1] for gen in generators]
+        out = [int(torch.Size(s).numel()) for s in shapes]
+        dense = all(type(head) is nn.Linear for head in heads)
+        self.padded = dense and g > 1 and g * max(out) <= pad_ratio * sum(out)
+        self.out = out
+        if self.padded:
+            self.head_weight = nn.Parameter(torch.zeros(g, max(out), heads[0].in_features))
+            self.head_bias = nn.Parameter(torch.zeros(g, max(out)))
+        else:
+            # not worth padding, run the generators' own heads
+            self.heads = nn.ModuleList(heads)
+
+    def _bn(self, x, j):
+        g, n, h = x.shape
+        x = x.transpose(0, 1).contiguous().view(n, g * h)
+        if self.training:
+            getattr(self, 'num_batches_tracked{}'.format(j)).add_(1)
+        x = F.batch_norm(x,
+                getattr(self, 'running_mean{}'.format(j)).view(-1),
+                getattr(self, 'running_var{}'.format(j)).view(-1),
+                self.bn_weights[j].view(-1), self.bn_biases[j].view(-1),
+                self.training, self.momentum, self.eps)
+        return x.view(n, g, h).transpose(0, 1)
+
+    def forward(self, x):
+        """ x: (G, N, z) -> list of G weight tensors shaped (N, *shape) """
+        for j in range(len(self.weights)):
+            x = torch.baddbmm(self.biases[j].unsqueeze(1), x,
+                    self.weights[j].transpose(1, 2))
+            if self.use_bn[j]:
+                x = self._bn(x, j)
+            x = self.act(x)
+        if self.padded:
+            x = torch.baddbmm(self.head_bias.unsqueeze(1), x,
+                    self.head_weight.transpose(1, 2))
+            return [x[i, :, :o].reshape(-1, *s)
+                    for i, (o, s) in enumerate(zip(self.out, self.shapes))]
+        return [head(x[i]).view(-1, *s)
+                for i, (head, s) in enumerate(zip(self.heads, self.shapes))]
+
+    def copy_(self, generators, to_bank=True):
+        """ copy parameters between the group and its generators """
+        def copy(dst, src):
+            if not to_bank:
+                dst, src = src, dst
+            dst.data.copy_(src.data)
+
+        for i, gen in enumerate(generators):
+            hidden = _layers(gen, 'linear')[:-1]
+            bns = _layers(gen, 'bn')
+            for j, layer in enumerate(hidden):
+                copy(self.weights[j][i], layer.weight)
+                copy(self.biases[j][i], layer.bias)
+                if self.use_bn[j]:
+                    copy(self.bn_weights[j][i], bns[j].weight)
+                    copy(self.bn_biases[j][i], bns[j].bias)
+                    copy(getattr(self, 'running_mean{}'.format(j))[i], bns[j].running_mean)
+                    copy(getattr(self, 'running_var{}'.format(j))[i], bns[j].running_var)
+                    if hasattr(bns[j], 'num_batches_tracked'):
+                        copy(getattr(self, 'num_batches_tracked{}'.format(j))[i],
+                                bns[j].num_batches_tracked)
+            if self.padded:
+                head = _layers(gen, 'linear')[-1]
+                o = self.out[i]
+                copy(self.head_weight[i, :o], head.weight)
+                copy(self.head_bias[i, :o], head.bias)
+
+
+class GeneratorBank(nn.Module):
+    def __init__(self, generators, shapes, pad_ratio=1.5):
+        super(GeneratorBank, self).__init__()
+        self.name = 'GeneratorBank'
+        # plain list, the generators are not submodules of the bank
+        self.generators = list(generators)
+        keys, self.index = [], []
+        for i, gen in enumerate(self.generators):
+            hidden = _layers(gen, 'linear')[:-1]
+            key = (tuple(tuple(l.weight.shape) for l in hidden),
+                    len(_layers(gen, 'bn')), type(getattr(gen, 'relu', None)))
+            if key not in keys:
+                keys.append(key)
+                self.index.append([])
+            self.index[keys.index(key)].append(i)
+        self.groups = nn.ModuleList([
+            _Group([self.generators[i] for i in idx],
+                [tuple(shapes[i]) for i in idx], pad_ratio)
+            for idx in self.index])
+        self.stack()
+
+    def forward(self, codes):
+        """ codes: one (N, z) code per generator, returns their weights in order """
+        out = [None] * len(self.generators)
+        for group, idx in zip(self.groups, self.index):
+            x = torch.stack([codes[i] for i in idx])
+            for i, w in zip(idx, group(x)):
+                out[i] = w
+        return out
+
+    def stack(self):
+        """ load the generators' current parameters into the bank """
+        with torch.no_grad():
+            for group, idx in zip(self.groups, self.index):
+                group.copy_([self.generators[i] for i in idx], to_bank=True)
+        return self
+
+    def unstack(self):
+        """ write the bank parameters back into the generators and return them """
+        with torch.no_grad():
+            for group, idx in zip(self.groups, self.index):
+                group.copy_([self.generators[i] for i in idx], to_bank=False)
+        return self.generators
@@ -0,0 +1,88 @@
+import numpy as np
+import torch
+
+from torch import nn
+from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint
+
+from models.models_mnist_small import DiscriminatorZ
+
+
+"""
+Chunked hypernetwork for targets too large for per layer output heads
+(wide, wide7). Every layer is cut into fixed size tiles and one shared head
+emits a tile from the layer code plus a learned embedding of the tile id;
+the tiles are concatenated and trimmed to the netdef shape.
+Head parameters scale with the tile, not the layer. With chunk_batch set the
+tiles are generated chunk_batch at a time under checkpoint, so the hidden
+activations kept for backward are one chunk's worth, recomputed on the way back.
+"""
+
+
+class Encoder(nn.Module):
+    def __init__(self, args):
+        super(Encoder, self).__init__()
+        for k, v in vars(args).items():
+            setattr(self, k, v)
+        self.name = 'Encoder'
+        self.n_layers = len(self.shapes)
+        self.linear1 = nn.Linear(self.ze, 512)
+        self.linear2 = nn.Linear(512, 512)
+        self.linear3 = nn.Linear(512, self.z*self.n_layers)
+        self.bn1 = nn.BatchNorm1d(512)
+        self.bn2 = nn.BatchNorm1d(512)
+        self.relu = nn.ELU(inplace=True)
+
+    def forward(self, x):
+        x = x.view(-1, self.ze)
+        x = self.relu(self.bn1(self.linear1(x)))
+        x = self.relu(self.bn2(self.linear2(x)))
+        x = self.linear3(x)
+        x = x.view(-1, self.n_layers, self.z)
+        return tuple(x[:, i] for i in range(self.n_layers))
+
+
+class ChunkedGenerator(nn.Module):
+    def __init__(self, args):
+        super(ChunkedGenerator, self).__init__()
+        for k, v in vars(args).items():
+            setattr(self, k, v)
+        self.name = 'ChunkedGenerator'
+        self.sizes = [int(np.prod(s)) for s in self.shapes]
+        n_tiles = [-(-size // self.tile) for size in self.sizes]
+        self.offsets = np.cumsum([0] + n_tiles).tolist()
+        self.embedding = nn.Embedding(self.offsets[-1], self.chunk_dim)
+        self.linear1 = nn.Linear(self.z + self.chunk_dim, 512)
+        self.linear2 = nn.Linear(512, 512)
+        self.linear3 = nn.Linear(512, self.tile)
+        self.relu = nn.ELU(inplace=True)
+
+    def _tiles(self, code, idx):
+        """ code: (N, z), idx: (T,) tile ids -> (N, T * tile) """
+        n, t = code.size(0), idx.size(0)
+        # linear1 on [code, embedding] split in two, the code half once per code
+        w = self.linear1.weight
+        hz = F.linear(code, w[:, :self.z], self.linear1.bias)
+        he = F.linear(self.embedding(idx), w[:, self.z:])
+        x = (hz.unsqueeze(1) + he.unsqueeze(0)).view(n * t, -1)
+        x = self.relu(x)
+        x = self.relu(self.linear2(x))
+        x = self.linear3(x)
+        return x.view(n, t * self.tile)
+
+    def layer(self, code, i):
+        """ weights of layer i for each code, (N, *shapes[i]) """
+        idx = torch.arange(self.offsets[i], self.offsets[i+1], device=code.device)
+        step = self.chunk_batch or idx.size(0)
+        chunks = []
+        for c in idx.split(step):
+            if self.chunk_batch and torch.is_grad_enabled():
+                chunks.append(checkpoint(self._tiles, code, c, use_reentrant=False))
+            else:
+                chunks.append(self._tiles(code, c))
+        x = torch.cat(chunks, 1)[:, :self.sizes[i]]
+        return x.contiguous().view(-1, *self.shapes[i])
+
+    def forward(self, codes):
+        """ one code per layer, returns the layers in netdef order """
+        return [self.layer(code, i) for i, code in enumerate(codes)]
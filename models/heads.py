@@ -0,0 +1,59 @@
+import math
+import numpy as np
+import torch
+
+from torch import nn
+
+
+"""
+Output heads for the weight generators.
+A dense head is nn.Linear(in, prod(shape)), which is most of the generator's
+parameters (and optimizer state) for the larger layers. LowRankHead emits
+the layer as U (m x r) times V (r x n) instead, with m the output units and
+n the fan in (in channels * k * k for conv filters).
+Both return flat (N, prod(shape)) rows so the generators keep their view().
+"""
+
+
+class LowRankHead(nn.Module):
+    def __init__(self, in_features, shape, rank):
+        super(LowRankHead, self).__init__()
+        self.m = shape[0]
+        self.n = int(np.prod(shape[1:]))
+        self.rank = rank
+        self.u = nn.Linear(in_features, self.m * rank)
+        self.v = nn.Linear(in_features, rank * self.n)
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        """
+        same output variance as the dense head at init: for unit variance
+        inputs nn.Linear gives (1 + 1/in) / 3 per output, and a sum of r
+        products of independent factors gets that when each factor has
+        variance sqrt(dense / r)
+        """
+        fan_in = self.u.in_features
+        dense = (1. + 1. / fan_in) / 3.
+        bound = math.sqrt(3. * math.sqrt(dense / self.rank) / fan_in)
+        for layer in (self.u, self.v):
+            nn.init.uniform_(layer.weight, -bound, bound)
+            nn.init.zeros_(layer.bias)
+
+    def forward(self, x):
+        u = self.u(x).view(-1, self.m, self.rank)
+        v = self.v(x).view(-1, self.rank, self.n)
+        return torch.bmm(u, v).view(x.size(0), -1)
+
+
+def head_rank(args, layer):
+    """ rank for a generator layer from args.head_rank, e.g. '0,8,0'; 0 is dense """
+    ranks = getattr(args, 'head_rank', None)
+    if not ranks:
+        return 0
+    return int(str(ranks).split(',')[layer])
+
+
+def make_head(in_features, shape, rank=0):
+    if not rank:
+        return nn.Linear(in_features, int(np.prod(shape)))
+    return LowRankHead(in_features, shape, rank)
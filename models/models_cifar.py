@@ -178,7 +178,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         x = self.relu(self.linear1(x))
         x = self.relu(self.linear2(x))
         x = self.relu(self.linear3(x))
@@ -4,6 +4,8 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
+from models.heads import make_head, head_rank
+
 
 class Encoder(nn.Module):
     def __init__(self, args):
@@ -41,7 +43,7 @@ class GeneratorW1(nn.Module):
         self.linear1 = nn.Linear(self.z, 256)
         self.linear2 = nn.Linear(256, 256)
         self.linear3 = nn.Linear(256, 512)
-        self.linear4 = nn.Linear(512, 800)
+        self.linear4 = make_head(512, (32, 1, 5, 5), head_rank(args, 0))
         self.bn1 = nn.BatchNorm1d(256)
         self.bn2 = nn.BatchNorm1d(256)
         self.bn3 = nn.BatchNorm1d(512)
@@ -67,7 +69,7 @@ class GeneratorW2(nn.Module):
         self.linear1 = nn.Linear(self.z, 256)
         self.linear2 = nn.Linear(256, 1600)
         self.linear3 = nn.Linear(1600, 6400)
-        self.linear4 = nn.Linear(6400, 25600)
+        self.linear4 = make_head(6400, (32, 32, 5, 5), head_rank(args, 1))
         self.bn1 = nn.BatchNorm1d(256)
         self.bn2 = nn.BatchNorm1d(1600)
         self.bn3 = nn.BatchNorm1d(6400)
@@ -92,7 +94,7 @@ class GeneratorW3(nn.Module):
         self.name = 'GeneratorLinear'
         self.linear1 = nn.Linear(self.z, 256)
         self.linear2 = nn.Linear(256, 256)
-        self.linear3 = nn.Linear(256, 512*10)
+        self.linear3 = make_head(256, (10, 512), head_rank(args, 2))
         self.bn1 = nn.BatchNorm1d(256)
         self.bn2 = nn.BatchNorm1d(256)
         self.relu = nn.ELU(inplace=True)
@@ -123,7 +125,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         x = self.relu(self.linear1(x))
         x = self.relu(self.linear2(x))
         x = self.linear3(x)
@@ -4,6 +4,8 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
+from models.heads import make_head, head_rank
+
 
 class Encoder(nn.Module):
     def __init__(self, args):
@@ -39,7 +41,7 @@ class GeneratorW1(nn.Module):
             setattr(self, k, v)
         self.name = 'GeneratorW1'
         self.linear1 = nn.Linear(self.z, 512)
-        self.linear2 = nn.Linear(512, 800)
+        self.linear2 = make_head(512, (32, 1, 5, 5), head_rank(args, 0))
         self.bn1 = nn.BatchNorm1d(512)
         self.relu = nn.ELU(inplace=True)
 
@@ -63,7 +65,7 @@ class GeneratorW2(nn.Module):
         self.linear1 = nn.Linear(input_dim, 1024)
         self.linear2 = nn.Linear(1024, 2048)
         self.linear3 = nn.Linear(2048, 4096)
-        self.linear4 = nn.Linear(4096, 25600)
+        self.linear4 = make_head(4096, (32, 32, 5, 5), head_rank(args, 1))
         self.bn1 = nn.BatchNorm1d(1024)
         self.bn2 = nn.BatchNorm1d(2048)
         self.bn3 = nn.BatchNorm1d(4096)
@@ -89,7 +91,7 @@ class GeneratorW3(nn.Module):
             setattr(self, k, v)
         self.name = 'GeneratorW3'
         self.linear1 = nn.Linear(self.z, 512)
-        self.linear2 = nn.Linear(512, 512*10)
+        self.linear2 = make_head(512, (10, 512), head_rank(args, 2))
         self.bn1 = nn.BatchNorm1d(512)
         self.relu = nn.ELU(inplace=True)
 
@@ -155,7 +157,7 @@ class DiscriminatorZ(nn.Module):
 
     def forward(self, x):
         # print ('Dz in: ', x.shape)
-        x = x.view(self.batch_size, -1)
+        x = x.view(x.size(0), -1)
         x = self.relu(self.linear1(x))
         x = self.relu(self.linear2(x))
         x = self.linear3(x)
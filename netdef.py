@@ -3,16 +3,22 @@ def nets():
     networks['wide'] = {
             'name': 'Wide',
             'n_layers': 4,
-            'layer_names': ['conv1', 'conv2'],
-            'shapes': [(1, 128, 3, 3), (128, 256, 3, 3), (1024, 1024), (1024, 10)],
-            'base_shape': 3
+            'layer_names': ['conv1.0', 'conv2.0', 'fc1.0', 'fc2'],
+            'shapes': [(128, 1, 3, 3), (256, 128, 3, 3), (1024, 1024), (10, 1024)],
+            'base_shape': 3,
+            'activation': 'relu',
+            'pooling': [2, 4],
+            'flatten': 1024,
     }
     networks['wide7'] = {
             'name': 'Wide7',
             'n_layers': 4,
-            'layer_names': ['conv1', 'conv2', 'linear1', 'linear2'],
-            'shapes': [(1, 128, 7, 7), (128, 256, 7, 7), (1024, 1024), (1024, 10)],
-            'base_shape': 7
+            'layer_names': ['conv1.0', 'conv2.0', 'linear1.0', 'linear2'],
+            'shapes': [(128, 1, 7, 7), (256, 128, 7, 7), (1024, 1024), (10, 1024)],
+            'base_shape': 7,
+            'activation': 'relu',
+            'pooling': [2, 2],
+            'flatten': 1024,
     }
     networks['net'] = {
             'name': '1x',
@@ -33,21 +39,31 @@ def nets():
             'n_layers': 2,
             'layer_names': ['conv1', 'linear'],
             'shapes': [(64, 1, 7, 7), (10, 1600)],
-            'base_shape': 7
+            'base_shape': 7,
+            'activation': 'relu',
+            'pooling': [4],
+            'flatten': 1600,
             }
     networks['small'] = {
             'name': 'Small',
             'n_layers': 2,
             'layer_names': ['conv1.0', 'linear'],
             'shapes': [(64, 1, 7, 7), (10, 3136)],
-            'base_shape': 7
+            'base_shape': 7,
+            'activation': 'relu',
+            'padding': [4],
+            'pooling': [4],
+            'flatten': 3136,
             }
     networks['small2'] = {
             'name': 'Small2',
             'n_layers': 3,
             'layer_names': ['conv1.0', 'conv2.0', 'linear'],
             'shapes': [(32, 1, 5, 5), (32, 32, 5, 5), (10, 512)],
-            'base_shape': 5
+            'base_shape': 5,
+            'activation': 'leaky_relu',
+            'pooling': [2, 2],
+            'flatten': 512,
             }
     networks['tiny'] = {
             'name': 'Tiny',
@@ -75,13 +91,19 @@ def nets():
             'n_layers': 5, 
             'layer_names': ['conv1', 'conv2', 'linear1', 'linear2', 'linear3'],
             'shapes': [(6, 3, 5, 5), (16, 6, 5, 5), (120, 400), (84, 120), (10, 84)],
-            'base_shape': 5
+            'base_shape': 5,
+            'activation': 'relu',
+            'pooling': [2, 2],
+            'flatten': 400,
             }
     networks['mednet'] = { 
             'name': 'MedNet',
             'n_layers': 5, 
             'layer_names': ['conv1', 'conv2', 'conv3', 'fc1', 'fc2'],
             'shapes': [(16, 3, 3, 3), (32, 16, 3, 3), (32, 32, 3, 3), (64, 128), (10, 64)],
-            'base_shape': 3
+            'base_shape': 3,
+            'activation': 'relu',
+            'pooling': [2, 2, 2],
+            'flatten': 128,
             }
     return networks
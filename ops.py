@@ -1,10 +1,20 @@
+import inspect
 import torch
 import torch.nn.functional as F
+from torch import optim
+
+
+def _params(module):
+    if isinstance(module, optim.Optimizer):
+        return [p for group in module.param_groups for p in group['params']]
+    return module.parameters()
 
 
 def batch_zero_grad(modules):
+    """ takes modules or optimizers, grads are released (None) instead of zeroed """
     for module in modules:
-        module.zero_grad()
+        for p in _params(module):
+            p.grad = None
 
 
 def batch_update_optim(optimizers):
@@ -12,10 +22,38 @@ def batch_update_optim(optimizers):
         optimizer.step()
 
 
+class OptimGroup(object):
+    """
+    One Adam over several modules, each module keeps its own lr.
+    Every step is a single (multi tensor when torch supports it) update
+    instead of one python loop per module optimizer.
+    """
+    def __init__(self, modules, lrs, **kwargs):
+        self.modules = list(modules)
+        groups = [{'params': list(m.parameters()), 'lr': lr}
+                for m, lr in zip(self.modules, lrs)]
+        accepts = inspect.signature(optim.Adam.__init__).parameters
+        if 'foreach' in accepts:
+            kwargs.setdefault('foreach', True)
+        self.optimizer = optim.Adam(groups, **kwargs)
+
+    def zero_grad(self):
+        batch_zero_grad(self.modules)
+
+    def step(self):
+        self.optimizer.step()
+
+    def state_dict(self):
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state):
+        self.optimizer.load_state_dict(state)
+
+
 def free_params(modules):
     for module in modules:
         for p in module.parameters():
-            p.requires_grad = False
+            p.requires_grad = True
 
 
 def frozen_params(modules):
@@ -35,3 +73,17 @@ def pretrain_loss(encoded, noise):
     cov_e /= 999
     cov_loss = F.mse_loss(cov_z, cov_e)
     return mean_loss, cov_loss
+
+
+def z_adversary_loss(netD, codes, noise):
+    """
+    D loss over every layer code in a single forward / backward
+    codes are detached so the step stays out of the generator graph,
+    noise stacks one real batch per code, losses are kept per code
+    """
+    n = len(codes)
+    fake = torch.cat([code.detach() for code in codes])
+    d_out = netD(torch.cat([noise, fake])).view(2, n, -1)
+    d_real, d_fake = d_out[0].mean(1), d_out[1].mean(1)
+    d_loss = -1 * torch.log(1 - d_real) - torch.log(d_fake)
+    return d_loss.sum()
@@ -0,0 +1,234 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+import device
+
+
+"""
+Population batched target networks.
+Generated weights carry a leading population dim P and every member sees the
+same data batch. Convolutions run as a single grouped conv (one group per
+member) and linear layers as a single batched matmul, so the whole population
+is one forward and one backward instead of P of each.
+EnsembleEvaluator does the same for evaluation, tiled to a memory budget.
+"""
+
+
+def conv2d(x, w, stride=1, padding=0):
+    """ x: (B, C, H, W) shared or (B, P*C, H, W), w: (P, O, C, k, k) """
+    n, o = w.shape[:2]
+    groups = 1 if x.size(1) == w.size(2) else n
+    w = w.contiguous().view(n * o, *w.shape[2:])
+    # shared input: stacking the filters is one dense conv, no need to repeat data
+    return F.conv2d(x, w, stride=stride, padding=padding, groups=groups)
+
+
+def flatten(x, n, features=-1):
+    """ (B, P*C, H, W) -> (P, B, C*H*W), same order as x.view(B, -1) per member """
+    return x.contiguous().view(x.size(0), n, features).transpose(0, 1)
+
+
+def linear(x, w):
+    """ x: (B, F) shared or (P, B, F), w: (P, O, F) -> (P, B, O) """
+    n, o = w.shape[:2]
+    if x.dim() == 2:
+        out = F.linear(x, w.contiguous().view(n * o, -1))
+        return out.view(x.size(0), n, o).transpose(0, 1)
+    return torch.bmm(x, w.transpose(1, 2))
+
+
+activations = {
+        'relu': F.relu,
+        'leaky_relu': F.leaky_relu,
+        'elu': F.elu,
+        }
+
+_compiled = {}
+
+
+def compile_net(modeldef):
+    """
+    build the functional forward for a netdef entry, cached by name
+    conv layers (4d shapes) run conv -> act -> max pool, the first linear
+    flattens, every layer but the last is followed by the activation
+    """
+    name = modeldef['name']
+    if name not in _compiled:
+        _compiled[name] = _build(modeldef)
+    return _compiled[name]
+
+
+def _build(modeldef):
+    shapes = modeldef['shapes']
+    act = activations[modeldef['activation']]
+    n_conv = len([s for s in shapes if len(s) == 4])
+    padding = modeldef.get('padding', [0] * n_conv)
+    pooling = modeldef.get('pooling', [0] * n_conv)
+    features = modeldef.get('flatten', -1)
+    last = len(shapes) - 1
+
+    def layer(i, n, x, w):
+        if len(shapes[i]) == 4:
+            x = act(conv2d(x, w, padding=padding[i]))
+            if pooling[i]:
+                x = F.max_pool2d(x, pooling[i], pooling[i])
+            return x
+        if x.dim() == 4:
+            x = flatten(x, n, features)
+        x = linear(x, w)
+        if i < last:
+            x = act(x)
+        return x
+
+    def forward(Z, data, recompute=False):
+        """
+        Z: weights shaped like netdef shapes, optionally with a leading P
+        recompute: keep only layer inputs for backward, redo each layer then
+        """
+        single = Z[0].dim() == len(shapes[0])
+        if single:
+            Z = [w.unsqueeze(0) for w in Z]
+        n = Z[0].size(0)
+        recompute = recompute and torch.is_grad_enabled()
+        x = data
+        for i, w in enumerate(Z):
+            if recompute:
+                x = checkpoint(layer, i, n, x, w, use_reentrant=False)
+            else:
+                x = layer(i, n, x, w)
+        if single:
+            x = x[0]
+        return x
+
+    return forward
+
+
+def clf_loss(logits, target):
+    """ per member mean cross entropy and number correct, both shaped (P,) """
+    if logits.dim() == 2:
+        correct, loss = clf_loss(logits.unsqueeze(0), target)
+        return correct[0], loss[0]
+    n, b, c = logits.shape
+    loss = F.cross_entropy(logits.reshape(n * b, c), target.repeat(n),
+            reduction='none')
+    loss = loss.view(n, b).mean(1)
+    pred = logits.detach().max(2)[1]
+    correct = pred.eq(target.view(1, -1)).long().sum(1)
+    return correct, loss
+
+
+def target_logits(args, Z, data):
+    """
+    target net forward with the args.recompute mode:
+    '' / 'none' keeps every activation for backward,
+    'layer' checkpoints each layer (conv + act + pool),
+    'chunk' checkpoints the whole net, args.recompute_chunk members at a time
+    """
+    forward = compile_net(args.stat)
+    mode = getattr(args, 'recompute', '')
+    if mode == 'layer':
+        return forward(Z, data, recompute=True)
+    if mode == 'chunk' and torch.is_grad_enabled() and Z[0].dim() > len(args.stat['shapes'][0]):
+        step = args.recompute_chunk
+        run = lambda x, *ws: forward(list(ws), x)
+        return torch.cat([checkpoint(run, data, *[w[s:s+step] for w in Z], use_reentrant=False)
+            for s in range(0, Z[0].size(0), step)])
+    return forward(Z, data)
+
+
+def train_clf(args, Z, data, target):
+    """ calc classifier loss on the target net, for a whole population at once """
+    data, target = data.to(device.get()), target.to(device.get())
+    logits = target_logits(args, Z, data)
+    return clf_loss(logits, target)
+
+
+def backward_clf(args, Z, data, target, scale=1.):
+    """
+    train_clf followed by (scale * loss.sum()).backward(), returns the
+    detached (correct, loss). With args.population_chunk set the target net
+    runs that many members at a time on detached weights, the weight grads
+    are gathered and pushed through the generators in one backward, so the
+    generators (and their batchnorms) still see the whole population and the
+    grads match the unchunked step. Target activations are held for one
+    chunk at a time.
+    """
+    chunk = getattr(args, 'population_chunk', 0)
+    if not chunk or chunk >= Z[0].size(0):
+        correct, loss = train_clf(args, Z, data, target)
+        (scale * loss.sum()).backward()
+        return correct, loss.detach()
+    data, target = data.to(device.get()), target.to(device.get())
+    grads = [[] for _ in Z]
+    corrects, losses = [], []
+    for start in range(0, Z[0].size(0), chunk):
+        part = [w[start:start+chunk].detach().requires_grad_() for w in Z]
+        correct, loss = clf_loss(target_logits(args, part, data), target)
+        for g, w in zip(grads, torch.autograd.grad(scale * loss.sum(), part)):
+            g.append(w)
+        corrects.append(correct)
+        losses.append(loss.detach())
+    torch.autograd.backward(Z, [torch.cat(g) for g in grads])
+    return torch.cat(corrects), torch.cat(losses)
+
+
+def peak_features(modeldef, shape):
+    """ largest activation of one member on one image, in elements; shape: (C, H, W) """
+    c, h, w = shape
+    n_conv = len([s for s in modeldef['shapes'] if len(s) == 4])
+    padding = modeldef.get('padding', [0] * n_conv)
+    pooling = modeldef.get('pooling', [0] * n_conv)
+    peak = c * h * w
+    for i, s in enumerate(modeldef['shapes']):
+        if len(s) == 4:
+            h, w = h + 2 * padding[i] - s[2] + 1, w + 2 * padding[i] - s[3] + 1
+            peak = max(peak, s[0] * h * w)
+            if pooling[i]:
+                h, w = h // pooling[i], w // pooling[i]
+        else:
+            peak = max(peak, s[0])
+    return peak
+
+
+class EnsembleEvaluator(object):
+    """
+    inference for N generated networks on one data batch, (N, B, C) logits.
+    Runs the compiled forward on tiles of members x images sized so a
+    layer's input and output for the tile fit in budget bytes; the data
+    batch is shared, never repeated per member.
+    """
+    def __init__(self, modeldef, budget=2**30):
+        self.modeldef = modeldef
+        self.forward = compile_net(modeldef)
+        self.budget = budget
+
+    def tiles(self, n, data):
+        """ (members, images) per tile for n members on data """
+        b = data.size(0)
+        # a layer's input and output are alive together
+        per = 2 * data.element_size() * peak_features(self.modeldef, data.shape[1:])
+        n_tile = self.budget // (per * b)
+        if n_tile >= 1:
+            return min(n, n_tile), b
+        return 1, max(1, min(b, self.budget // per))
+
+    def __call__(self, Z, data):
+        """ Z: per layer weights shaped (N, *shape), data: (B, ...) """
+        data = data.to(device.get())
+        n, b = Z[0].size(0), data.size(0)
+        n_tile, b_tile = self.tiles(n, data)
+        out = None
+        with torch.no_grad():
+            for i in range(0, n, n_tile):
+                part = [w[i:i+n_tile] for w in Z]
+                x = torch.cat([self.forward(part, data[j:j+b_tile])
+                    for j in range(0, b, b_tile)], 1)
+                if out is None:
+                    out = x.new_empty(n, b, x.size(2))
+                out[i:i+n_tile] = x
+        return out
+
+    def sample(self, sampler, n, data):
+        """ logits of the next n members of a sampler.HypernetSampler """
+        return self(sampler.stack(n), data)
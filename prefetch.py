@@ -0,0 +1,102 @@
+import threading
+import torch
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import device
+
+
+"""
+Background staging for the training loops. A producer thread pulls the next
+batches from a loader, moves them to the device and draws the latent noise
+for the step (encoder input, discriminator prior) into a bounded queue, so
+the loop only ever takes a ready item:
+
+    noise = {'x': lambda: utils.sample_d(x_dist, args.batch_size, grad=False)}
+    for batch_idx, (data, target, z) in enumerate(Prefetcher(train, noise)):
+        codes = netE(z['x'])
+
+Torch releases the GIL inside its kernels, so a thread overlaps fine with
+the compute in the main loop. On cuda the producer pins the batch and
+copies it with non_blocking on its own stream, and records an event the
+loop's stream waits on before it touches the batch, so the copy overlaps
+the previous step on the device as well.
+"""
+
+
+_done = object()
+
+
+class Prefetcher(object):
+    def __init__(self, loader, noise=None, depth=2):
+        self.loader = loader
+        self.noise = noise or {}
+        self.depth = depth
+        self.dataset = getattr(loader, 'dataset', None)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _put(self, q, stop, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _stage(self, x):
+        if device.pin_memory() and not x.is_cuda and not x.is_pinned():
+            x = x.pin_memory()
+        return x.to(device.get(), non_blocking=True)
+
+    def _produce(self, q, stop):
+        try:
+            stream = torch.cuda.Stream() if device.get().type == 'cuda' else None
+            for data, target in self.loader:
+                event = None
+                if stream is None:
+                    data, target = self._stage(data), self._stage(target)
+                    noise = {k: sample() for k, sample in self.noise.items()}
+                else:
+                    with torch.cuda.stream(stream):
+                        data, target = self._stage(data), self._stage(target)
+                        noise = {k: sample() for k, sample in self.noise.items()}
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                if not self._put(q, stop, (data, target, noise, event)):
+                    return
+            self._put(q, stop, _done)
+        except Exception as e:
+            # handed to the consumer and raised there
+            self._put(q, stop, e)
+
+    def __iter__(self):
+        q = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._produce, args=(q, stop))
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                item = q.get()
+                if item is _done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                data, target, noise, event = item
+                if event is not None:
+                    current = torch.cuda.current_stream()
+                    current.wait_event(event)
+                    # made on the producer stream, used on this one
+                    for x in [data, target] + list(noise.values()):
+                        x.record_stream(current)
+                yield data, target, noise
+        finally:
+            # also runs when the loop breaks early, the producer then exits
+            stop.set()
+            worker.join()
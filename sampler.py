@@ -0,0 +1,76 @@
+import torch
+
+import utils
+
+
+"""
+Serves target networks out of a pool of hypernet samples. The pool is
+pool_size networks from one utils.sample_hypernet call (still 32 codes per
+generator batch) and is refilled only once every member has been handed
+out, so no generated network is thrown away. Each sampler draws from its
+own latent source, so with a seed set every refill continues the stream
+rather than repeating the last pool.
+"""
+
+
+class HypernetSampler(object):
+    def __init__(self, hypernet, args, arch=None, pool_size=320, mode=None):
+        self.hypernet = hypernet
+        self.args = args
+        self.arch = arch
+        self.pool_size = pool_size
+        self.mode = mode or getattr(args, 'sampling', 'iid')
+        self.seed = getattr(args, 'latent_seed', None)
+        self.x_dist = utils.create_d(utils.latent_width(args, hypernet[0]),
+                seed=self.seed, stream=3, mode=self.mode)
+        self.pool = None
+        self.pos = pool_size
+
+    def _refill(self):
+        with torch.no_grad():
+            self.pool = utils.sample_hypernet(self.hypernet, self.args,
+                    n=self.pool_size, x_dist=self.x_dist)
+        self.pos = 0
+
+    def stack(self, k):
+        """ the next k members as per layer tensors shaped (k, *shape) """
+        parts, need = [], k
+        while need:
+            if self.pos == self.pool_size:
+                self._refill()
+            take = min(need, self.pool_size - self.pos)
+            parts.append([l[self.pos:self.pos+take] for l in self.pool])
+            self.pos += take
+            need -= take
+        if len(parts) == 1:
+            return parts[0]
+        return [torch.cat(l) for l in zip(*parts)]
+
+    def next_weights(self, k=1):
+        """ the next k members, each a tuple of its layer weights """
+        return list(zip(*self.stack(k)))
+
+    def next_model(self, arch=None):
+        """ the next member loaded into arch (a target net module), in eval mode """
+        arch = arch or self.arch
+        model = utils.weights_to_clf(self.next_weights(1)[0], arch,
+                self.args.stat['layer_names'])
+        model.eval()
+        return model
+
+
+_pooled = {}
+
+
+def pooled(hypernet, args, pool_size=320):
+    """
+    one sampler per (hypernet, sampling mode, latent seed, pool size) for
+    the process, for sample_model style helpers. Keyed on the ids of the
+    hypernet's modules; the cached sampler holds them strongly, so an id
+    in the key can never be reused by another module while it is cached
+    """
+    key = (tuple(id(m) for m in hypernet), getattr(args, 'sampling', 'iid'),
+            getattr(args, 'latent_seed', None), pool_size)
+    if key not in _pooled:
+        _pooled[key] = HypernetSampler(hypernet, args, pool_size=pool_size)
+    return _pooled[key]
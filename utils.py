@@ -3,6 +3,8 @@ import sys
 import time
 import torch
 import natsort
+import device
+import latent
 import datagen
 import argparse
 import scipy.misc
@@ -16,29 +18,24 @@ from glob import glob
 from scipy.misc import imsave
 import torch.nn as nn
 import torch.nn.init as init
-import torch.distributions.multivariate_normal as N
 
 
 def sample_z(args, grad=True):
-    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).cuda()
+    z = torch.randn(args.batch_size, args.dim, requires_grad=grad).to(device.get())
     return z
 
 
-def create_d(shape):
-    mean = torch.zeros(shape)
-    cov = torch.eye(shape)
-    D = N.MultivariateNormal(mean, cov)
-    return D
+def create_d(shape, seed=None, stream=0, mode='iid', bank=0):
+    """ N(0, I) sampler on the device: iid, antithetic or sobol, optionally banked, see latent.py """
+    return latent.create_d(shape, seed, stream, mode, bank)
 
 
 def sample_d(D, shape, scale=1., grad=True):
-    z = scale * D.sample((shape,)).cuda()
-    z.requires_grad = grad
-    return z
+    return latent.sample_d(D, shape, scale, grad)
 
 
 def sample_z_like(shape, scale=1., grad=True):
-    return torch.randn(*shape, requires_grad=grad).cuda()
+    return latent.sample_z_like(shape, scale, grad)
 
 
 def save_model(args, model, optim):
@@ -57,7 +54,7 @@ def load_model(args, model, optim):
     path = '{}/{}/{}_{}.pt'.format(
             args.dataset, args.model, model.name, args.exp)
     path = model_dir + path
-    ckpt = torch.load(path)
+    ckpt = device.load(path)
     model.load_state_dict(ckpt['state_dict'])
     optim.load_state_dict(ckpt['optimizer'])
     acc = ckpt['best_acc']
@@ -83,10 +80,10 @@ def save_clf(args, Z, acc):
     """ gross """
     if args.dataset == 'mnist':
         import models.mnist_clf as models
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     elif args.dataset == 'cifar':
         import models.cifar_clf as models
-        model = models.MedNet().cuda() 
+        model = models.MedNet().to(device.get()) 
     """ end gross """
 
     state = model.state_dict()
@@ -96,7 +93,8 @@ def save_clf(args, Z, acc):
         loader = state[name]
         state[name] = params.detach()
         assert state[name].equal(loader) == False
-        model.load_state_dict(state)
+    # saving needs a real state dict, one load after all layers are set
+    model.load_state_dict(state)
     #import cifar
     #ac, loss = cifar.test(args, model, 0)
     #print ('acc: {}, loss: {}'.format(ac, loss))
@@ -108,13 +106,11 @@ def save_clf(args, Z, acc):
 
 
 def save_hypernet_mnist(args, models, acc):
-    netE, W1, W2, W3 = models
-    hypernet_dict = {
-            'E':  get_net_only(netE),
-            'W1': get_net_only(W1),
-            'W2': get_net_only(W2),
-            'W3': get_net_only(W3),
-            }
+    """ encoder then generators, saved as E, W1..Wn (a chunked generator is W1) """
+    netE, generators = models[0], models[1:]
+    hypernet_dict = {'E': get_net_only(netE)}
+    for i, W in enumerate(generators):
+        hypernet_dict['W{}'.format(i+1)] = get_net_only(W)
     path = 'exp_models/hypermnist_{}_{}.pt'.format(args.exp, acc)
     if args.scratch:
         path = '/scratch/eecs-share/ratzlafn/HyperGAN/' + path
@@ -145,12 +141,12 @@ def load_hypernet(path, args=None):
     if args is None:
         args = load_default_args()
     import models.models_mnist_small as hyper
-    netE = hyper.Encoder(args).cuda()
-    W1 = hyper.GeneratorW1(args).cuda()
-    W2 = hyper.GeneratorW2(args).cuda()
-    W3 = hyper.GeneratorW3(args).cuda()
+    netE = hyper.Encoder(args).to(device.get())
+    W1 = hyper.GeneratorW1(args).to(device.get())
+    W2 = hyper.GeneratorW2(args).to(device.get())
+    W3 = hyper.GeneratorW3(args).to(device.get())
     print ('loading hypernet from {}'.format(path))
-    d = torch.load(path)
+    d = device.load(path)
     netE = load_net_only(netE, d['E'])
     W1 = load_net_only(W1, d['W1'])
     W2 = load_net_only(W2, d['W2'])
@@ -158,26 +154,94 @@ def load_hypernet(path, args=None):
     return (netE, W1, W2, W3)
 
 
-def sample_hypernet(hypernet, args=None):
+_x_dists = {}
+
+
+def latent_width(args=None, netE=None):
+    """ encoder input width: args.ze, else what the encoder was built with """
+    return getattr(args, 'ze', None) or getattr(netE, 'ze', 300)
+
+
+def latent_source(args=None, mode=None, width=300):
+    """
+    encoder latents for sampling networks, one source per (seed, mode,
+    width) for the process: seeded calls continue one counter based stream
+    instead of replaying the same draw, and Sobol continues its sequence
+    """
+    mode = mode or getattr(args, 'sampling', 'iid')
+    key = (getattr(args, 'latent_seed', None), mode, width)
+    if key not in _x_dists:
+        _x_dists[key] = create_d(width, seed=key[0], stream=2, mode=mode)
+    return _x_dists[key]
+
+
+def sample_hypernet(hypernet, args=None, n=32, mode=None, x_dist=None):
+    """
+    n networks from one latent draw of x_dist (default latent_source for
+    args.sampling: iid, antithetic or sobol), run through the hypernet 32
+    codes at a time like before
+    """
     netE, W1, W2, W3 = hypernet
-    x_dist = create_d(300)
-    z = sample_d(x_dist, 32)
-    codes = netE(z)
-    l1 = W1(codes[0])
-    l2 = W2(codes[1])
-    l3 = W3(codes[2])
-    return l1, l2, l3
+    if x_dist is None:
+        x_dist = latent_source(args, mode, latent_width(args, netE))
+    z = sample_d(x_dist, n)
+    l1, l2, l3 = [], [], []
+    for x in z.split(32):
+        codes = netE(x)
+        l1.append(W1(codes[0]))
+        l2.append(W2(codes[1]))
+        l3.append(W3(codes[2]))
+    return torch.cat(l1), torch.cat(l2), torch.cat(l3)
+
+
+try:
+    from torch.func import functional_call
+except ImportError:
+    try:
+        from torch.nn.utils.stateless import functional_call
+    except ImportError:
+        functional_call = None
+
+
+def _swapped_call(model, weights, inputs):
+    """ torch without functional_call: swap the tensors in for one call """
+    saved = []
+    for name, w in weights.items():
+        path, attr = name.rsplit('.', 1)
+        module = model
+        for p in path.split('.'):
+            module = getattr(module, p)
+        saved.append((module, attr, module._parameters.pop(attr)))
+        setattr(module, attr, w)
+    try:
+        return model(*inputs)
+    finally:
+        for module, attr, param in saved:
+            delattr(module, attr)
+            module._parameters[attr] = param
+
+
+class Bound(nn.Module):
+    """
+    runs a target architecture with generated weights bound by layer name,
+    no copies and the wrapped model is never modified
+    """
+    def __init__(self, model, weights, names):
+        super(Bound, self).__init__()
+        self.model = model
+        self.bound = dict(('{}.weight'.format(n), w) for n, w in zip(names, weights))
+
+    def forward(self, *inputs):
+        if functional_call is not None:
+            return functional_call(self.model, self.bound, inputs)
+        return _swapped_call(self.model, self.bound, inputs)
 
 
 def weights_to_clf(weights, model, names):
-    state = model.state_dict()
-    layers = zip(names, weights)
-    for i, (name, params) in enumerate(layers):
-        name = name + '.weight'
-        loader = state[name]
-        state[name] = params.detach()
-        model.load_state_dict(state)
-    return model
+    """ model bound to (detached) generated weights, see Bound """
+    if isinstance(model, Bound):
+        model = model.model
+    return Bound(model, [w.detach() for w in weights], names)
 
 
 def load_default_args():
@@ -9,7 +9,6 @@ from glob import glob
 from math import e, log
 import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
-from scipy.stats import mode
 from scipy.stats import entropy
 
 import torch
@@ -18,7 +17,11 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torchvision.utils import save_image
 
+import device
 import utils
+import sampler
+import population
+import ensemble
 import netdef
 import datagen
 import attacks
@@ -46,6 +49,8 @@ def load_args():
     parser.add_argument('--ft', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--hyper', type=bool, default=False, metavar='N', help='')
     parser.add_argument('--task', type=str, default='train', metavar='N', help='')
+    parser.add_argument('--eval_budget', type=int, default=1024, help='MB of activations per ensemble tile')
+    parser.add_argument('--eval_chunk', type=int, default=100, help='members per ensemble stats update')
 
     args = parser.parse_args()
     return args
@@ -55,11 +60,7 @@ def load_args():
 # gradient under a new network for each iteration: IFGSM
 # One step attacks, do they transfer, no need to modify attacks here. 
 def sample_fmodel(args, hypernet, arch):
-    w_batch = utils.sample_hypernet(hypernet)
-    rand = np.random.randint(32)
-    sample_w = (w_batch[0][rand], w_batch[1][rand], w_batch[2][rand])
-    model = utils.weights_to_clf(sample_w, arch, args.stat['layer_names'])
-    model.eval()
+    model = sampler.pooled(hypernet, args).next_model(arch)
     fmodel = attacks.load_model(model)
     return model, fmodel
 
@@ -111,8 +112,8 @@ def sample_adv_batch(data, target, fmodel, eps, attack):
     if adv == []:
         adv_batch, target_batch = None, None
     else:
-        adv_batch = torch.stack(adv).cuda()
-        target_batch = torch.stack(y).cuda()
+        adv_batch = torch.stack(adv).to(device.get())
+        target_batch = torch.stack(y).to(device.get())
     return adv_batch, target_batch, inter
 
 
@@ -127,6 +128,8 @@ def run_adv_hyper(args, hypernet):
     #    fmodels.append(fmodel_base)   
     #fmodel_base = attacks.load_model(FusedNet(models))
     model_base, fmodel_base = sample_fmodel(args, hypernet, arch)
+    pool = sampler.pooled(hypernet, args)
+    evaluator = population.EnsembleEvaluator(args.stat, args.eval_budget * 2**20)
     criterion = Misclassification()
     fgs = foolbox.attacks.FGSM(fmodel_base, criterion)
     _, test_loader = datagen.load_mnist(args)
@@ -139,7 +142,7 @@ def run_adv_hyper(args, hypernet):
             _soft, _logs, _vars, _ents = [], [], [], []
             _soft_adv, _logs_adv, _vars_adv, _ents_adv = [], [], [], []
             for idx, (data, target) in enumerate(test_loader):
-                data, target = data.cuda(), target.cuda()
+                data, target = data.to(device.get()), target.to(device.get())
                 adv_batch, target_batch, _ = sample_adv_batch(
                         data, target, fmodel_base, eps, fgs)
                 if adv_batch is None:
@@ -151,52 +154,23 @@ def run_adv_hyper(args, hypernet):
                 n_adv = len(target_batch) - correct.item()
                 total_adv += n_adv
                 
-                #dis = []
-                soft_out, pred_out, logits = [], [], []
-                soft_out_adv, pred_out_adv, logits_adv = [], [], []
-                for n in range(n_models):
-                    model, fmodel = sample_fmodel(args, hypernet, arch) 
-                    output = model(data)
-                    soft_out.append(F.softmax(output, dim=1))
-                    #pred_out.append(output.data.max(1, keepdim=True)[1])
-                    #logits.append(output)
-
-                    output = model(adv_batch)
-                    soft_out_adv.append(F.softmax(output, dim=1))
-                    #pred_out_adv.append(output.data.max(1, keepdim=True)[1])
-                    #logits_adv.append(output)
-                    ## correction graph
-                    #pred = output.data.max(1, keepdim=True)[1]
-                    #correct = pred.eq(target_batch.data.view_as(pred)).long().cpu().sum()
-                    #c = len(pred_out) - correct.item()
-                    #print ('got {} / {} / {}'.format(correct.item(), len(target_batch), 32))
-                    #dis.append(correct.item()/n_adv)
-                    ##
-                #np.save('/scratch/eecs-share/ratzlafn/acc.npy', np.array(dis))
-                #sys.exit(0)    
-                    
-                softs = torch.stack(soft_out).float()
-                #preds = torch.stack(pred_out).float()
-                #logs = torch.stack(logits).float()
-                softs_adv = torch.stack(soft_out_adv).float()
-                #preds_adv = torch.stack(pred_out_adv).float()
-                #logs_adv = torch.stack(logits_adv).float()
-                #np.save('/scratch/eecs-share/ratzlafn/softs.npy', softs.detach().cpu().numpy())
-                #np.save('/scratch/eecs-share/ratzlafn/logs.npy', logs.detach().cpu().numpy())
-                #sys.exit(0)
+                # the same members on the clean and the adversarial batch,
+                # eval_chunk at a time into running stats
+                stats, stats_adv = ensemble.EnsembleStats(), ensemble.EnsembleStats()
+                for start in range(0, n_models, args.eval_chunk):
+                    Z = pool.stack(min(args.eval_chunk, n_models - start))
+                    stats.update(evaluator(Z, data))
+                    stats_adv.update(evaluator(Z, adv_batch))
                 # Measure variance of individual logits across models. 
                 # HyperGAN ensemble has lower variance across 10 class predictions 
                 # But a single logit has high variance acorss models
-                units_softmax = softs.var(0).mean().item() # var across models across images
-                ent = float(entropy(softs.mean(0).detach()).mean())
-                #units_logprob = logs.var(0).mean().item()
-                ensemble_var = softs.mean(0).var(1).mean().item()  
-
-                units_softmax_adv = softs_adv.var(0).mean().item() # var across models - images
-                ent_adv = float(entropy(softs_adv.mean(0).detach()).mean())
-        
-                #units_logprob_adv = logs_adv.var(0).mean().item()
-                ensemble_var_adv = softs_adv.mean(0).var(1).mean().item()
+                units_softmax = stats.variance().mean().item() # var across models across images
+                ent = float(entropy(stats.mean.cpu().numpy()).mean())
+                ensemble_var = stats.mean.var(1).mean().item()  
+
+                units_softmax_adv = stats_adv.variance().mean().item() # var across models - images
+                ent_adv = float(entropy(stats_adv.mean.cpu().numpy()).mean())
+                ensemble_var_adv = stats_adv.mean.var(1).mean().item()
                 """ Core Debug """
                 # print ('softmax var: ', units_softmax)
                 # print ('logprob var: ', units_logprob)
@@ -247,7 +221,7 @@ def run_adv_model(args, models):
         _soft, _logs, _vars, _ents = [], [], [], []
         _soft_adv, _logs_adv, _vars_adv, _ents_adv = [], [], [], []
         for idx, (data, target) in enumerate(test_loader):
-            data, target = data.cuda(), target.cuda()
+            data, target = data.to(device.get()), target.to(device.get())
             adv_batch, target_batch, _ = sample_adv_batch(data, target, fmodel, eps, fgs)
             
             if adv_batch is None:
@@ -344,9 +318,9 @@ def w_init(model, dist='normal'):
 """ returns instance of specific model without weights """
 def get_network(args):
     if args.net == 'small':
-        model = models.Small().cuda()
+        model = models.Small().to(device.get())
     elif args.net == 'small2':
-        model = models.Small2().cuda()
+        model = models.Small2().to(device.get())
     else:
         raise NotImplementedError
     return model
@@ -373,7 +347,7 @@ def adv_attack(args, path):
         models = []
         for path in paths:
             model = get_network(args)
-            model.load_state_dict(torch.load(path))
+            model.load_state_dict(device.load(path))
             models.append(model.eval())
         run_adv_model(args, models)
     
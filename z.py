@@ -15,6 +15,7 @@ import adversarial_test as adv
 args = adv.load_args()
 arch = adv.get_network(args)
 get_ipython().run_line_magic('clear', '')
+import device
 import utils; hypernet = utils.load_hypernet('hypermnist_0_0.984390625.pt')
 import netdef; args.stat = netdef.nets()[args.net]
 model_base, fmodel_base = adv.sample_fmodel(args, hypernet, arch)
@@ -41,7 +42,7 @@ paths = ['mnist_model_small2_0.pt', 'mnist_model_small2_1.pt', 'mnist_model_smal
 models = []
 for path in paths:
     model = adv.get_network(args)
-    model.load_state_dict(torch.load(path))
+    model.load_state_dict(device.load(path))
     models.append(model.eval())
     
 model = adv.FusedNet(models)